@@ -0,0 +1,369 @@
+"""
+Long-lived git processes for the read-only queries of git-tools.
+
+git-rp, git-sync and git-list-refs ask git many small questions: where the
+repository is, which branch is checked out, what a revision, ref or path
+resolves to, what an object contains, what a config value is. Forking git
+(often through /bin/sh) for each one costs far more than the answer. A
+GitRepository answers them instead from:
+
+- one `git rev-parse` for the repository's location,
+- long-lived `git cat-file --batch-check` and `--batch` coprocesses for
+  revisions, refs and objects,
+- one `git config --list` for config values, re-read only when the
+  repository's config file changes.
+
+Answers that cannot change during a run (queries starting with a full object
+name, such as "<commit>:path" or "<tag>^{commit}", that found an object) are
+kept in a bounded LRU; queries naming refs are always asked again, since refs
+move, and so are missing objects, which may be written later.
+
+The scripts find this module next to their own directory:
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    import git_batch
+"""
+
+import atexit
+import os
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+
+# Number of answers kept per repository
+CACHE_SIZE = 4096
+
+# Object bodies larger than this are not cached
+MAX_CACHED_OBJECT = 64 * 1024
+
+# A query starting with a full object name always has the same answer
+IMMUTABLE_QUERY = re.compile(r"^(?:[0-9a-f]{64}|[0-9a-f]{40})(?![0-9a-f])")
+
+
+class GitError(Exception):
+    """Raised when git cannot answer a query, e.g. outside a repository."""
+
+
+class LRUCache:
+    """Dictionary holding at most size entries, dropping the least recently used."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            return default
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class CatFile:
+    """Long-lived `git cat-file --batch` (or `--batch-check`) coprocess.
+
+    Queries are answered in order, so looking up many objects costs one
+    process instead of one fork per object.
+    """
+
+    def __init__(self, cwd=None, contents=True):
+        self.contents = contents
+        mode = "--batch" if contents else "--batch-check"
+        self.process = subprocess.Popen(["git", "cat-file", mode], cwd=cwd,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def query(self, specs):
+        """Yield (sha, type, data) for each spec, or None if it does not resolve.
+
+        data is the raw object body for --batch and None for --batch-check.
+        Every answer must be read before the next query.
+        """
+        specs = list(specs)
+        if len(specs) == 1:
+            self._write(specs)
+            yield self._read_answer()
+            return
+        # git answers each query as soon as it reads it, so with large answers
+        # its stdout fills up long before many queries are written; writing
+        # from another thread while reading here keeps both pipes moving
+        writer = threading.Thread(target=self._write, args=(specs,), daemon=True)
+        writer.start()
+        for _ in specs:
+            yield self._read_answer()
+        writer.join()
+
+    def _write(self, specs):
+        try:
+            self.process.stdin.write(b"".join(spec.encode('utf-8') + b"\n" for spec in specs))
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            # git exited; _read_answer reports it
+            pass
+
+    def info(self, spec):
+        """Return (sha, type) for spec, or None if it does not resolve."""
+        answer = next(self.query([spec]))
+        return answer[:2] if answer else None
+
+    def read(self, spec):
+        """Return (type, raw body) for spec, or None if it does not resolve."""
+        answer = next(self.query([spec]))
+        return answer[1:] if answer else None
+
+    def _read_answer(self):
+        header = self.process.stdout.readline()
+        if not header:
+            raise GitError("git cat-file exited unexpectedly")
+        header = header.rstrip(b"\n")
+        if header.endswith((b" missing", b" ambiguous")):
+            return None
+        sha, obj_type, size = header.decode('ascii').split(" ")
+        data = None
+        if self.contents:
+            data = self.process.stdout.read(int(size) + 1)[:-1]
+        return sha, obj_type, data
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+def config_key(key):
+    """Normalize a config key the way `git config --list` prints it.
+
+    Section and variable names are case-insensitive, subsections are not.
+    """
+    section, _, rest = key.partition(".")
+    subsection, _, name = rest.rpartition(".")
+    return ".".join(part for part in (section.lower(), subsection, name.lower()) if part)
+
+
+class GitRepository:
+    """Read-only queries on the repository containing cwd.
+
+    The git processes are started on first use and kept until close().
+    Safe to share between threads; relative queries such as "HEAD:./path"
+    are resolved against cwd.
+    """
+
+    def __init__(self, cwd=None, cache_size=CACHE_SIZE):
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+        self.cache = LRUCache(cache_size)
+        self._lock = threading.RLock()
+        self._location = None
+        self._check = None
+        self._batch = None
+        self._config = None
+        self._config_stamp = None
+
+    def _locate(self):
+        if self._location is None:
+            result = subprocess.run(["git", "rev-parse", "--is-bare-repository", "--is-inside-work-tree",
+                                     "--git-dir", "--git-common-dir", "--show-prefix"],
+                                    capture_output=True, text=True, cwd=self.cwd)
+            lines = result.stdout.split("\n")
+            if result.returncode != 0 or len(lines) < 5:
+                raise GitError(result.stderr.strip() or "not a git repository")
+            bare, inside, git_dir, common_dir, prefix = lines[:5]
+            toplevel = None
+            if inside == "true":
+                toplevel = self.cwd
+                for _ in filter(None, prefix.split("/")):
+                    toplevel = os.path.dirname(toplevel)
+            self._location = {
+                'bare': bare == "true",
+                'git_dir': os.path.normpath(os.path.join(self.cwd, git_dir)),
+                'common_dir': os.path.normpath(os.path.join(self.cwd, common_dir)),
+                'toplevel': toplevel,
+                'prefix': prefix,
+            }
+        return self._location
+
+    @property
+    def git_dir(self):
+        """Absolute path of the git directory (per worktree)."""
+        return self._locate()['git_dir']
+
+    @property
+    def common_dir(self):
+        """Absolute path of the git directory shared by all worktrees."""
+        return self._locate()['common_dir']
+
+    @property
+    def toplevel(self):
+        """Root of the working tree, or None in a bare repository or git directory."""
+        return self._locate()['toplevel']
+
+    @property
+    def prefix(self):
+        """Path of cwd relative to the working tree root ("" at the root), like --show-prefix."""
+        return self._locate()['prefix']
+
+    @property
+    def is_bare(self):
+        return self._locate()['bare']
+
+    def _coprocess(self, contents):
+        self._locate()
+        if contents:
+            if self._batch is None:
+                self._batch = CatFile(self.cwd, contents=True)
+            return self._batch
+        if self._check is None:
+            self._check = CatFile(self.cwd, contents=False)
+        return self._check
+
+    def query(self, specs):
+        """Return [(sha, type) or None] for each revision, ref or object query, in order."""
+        specs = list(specs)
+        answers = [None] * len(specs)
+        ask = []
+        with self._lock:
+            for i, spec in enumerate(specs):
+                key = ('info', spec)
+                if key in self.cache:
+                    answers[i] = self.cache.get(key)
+                else:
+                    ask.append(i)
+            if ask:
+                for i, answer in zip(ask, self._coprocess(False).query(specs[i] for i in ask)):
+                    answers[i] = answer[:2] if answer else None
+                    # A missing object may still be written or fetched later in the run
+                    if answer and IMMUTABLE_QUERY.match(specs[i]):
+                        self.cache.put(('info', specs[i]), answers[i])
+        return answers
+
+    def info(self, spec):
+        """Return (sha, type) for spec, or None if it does not resolve."""
+        return self.query([spec])[0]
+
+    def resolve(self, spec):
+        """Return the object name spec resolves to, like `git rev-parse --verify -q`, or None."""
+        answer = self.info(spec)
+        return answer[0] if answer else None
+
+    def read_many(self, specs):
+        """Return [(type, raw body) or None] for the object each query names, in order."""
+        specs = list(specs)
+        answers = [None] * len(specs)
+        ask = []
+        with self._lock:
+            for i, spec in enumerate(specs):
+                key = ('read', spec)
+                if key in self.cache:
+                    answers[i] = self.cache.get(key)
+                else:
+                    ask.append(i)
+            if ask:
+                for i, answer in zip(ask, self._coprocess(True).query(specs[i] for i in ask)):
+                    answers[i] = answer[1:] if answer else None
+                    if answer and IMMUTABLE_QUERY.match(specs[i]) and len(answer[2]) <= MAX_CACHED_OBJECT:
+                        self.cache.put(('read', specs[i]), answers[i])
+        return answers
+
+    def read(self, spec):
+        """Return (type, raw body) of the object spec names, or None."""
+        return self.read_many([spec])[0]
+
+    def current_branch(self):
+        """Return the checked out branch, or "HEAD" when detached, like `rev-parse --abbrev-ref HEAD`."""
+        try:
+            with open(os.path.join(self.git_dir, "HEAD")) as f:
+                head = f.read().strip()
+        except OSError as e:
+            raise GitError(f"cannot read HEAD: {e}")
+        if not head.startswith("ref: "):
+            return "HEAD"
+        target = head[len("ref: "):]
+        if target == "refs/heads/.invalid":
+            # reftable keeps the real HEAD elsewhere
+            result = subprocess.run(["git", "symbolic-ref", "-q", "--short", "HEAD"],
+                                    capture_output=True, text=True, cwd=self.cwd)
+            return result.stdout.strip() if result.returncode == 0 else "HEAD"
+        return target[len("refs/heads/"):] if target.startswith("refs/heads/") else target
+
+    def _config_files_stamp(self):
+        stamp = []
+        for path in (os.path.join(self.common_dir, "config"), os.path.join(self.git_dir, "config.worktree")):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return stamp
+
+    def _load_config(self):
+        stamp = self._config_files_stamp()
+        if self._config is not None and stamp == self._config_stamp:
+            return self._config
+        result = subprocess.run(["git", "config", "--list", "-z"], capture_output=True, cwd=self.cwd)
+        if result.returncode != 0:
+            raise GitError(result.stderr.decode('utf-8', 'replace').strip() or "cannot read config")
+        config = {}
+        for entry in result.stdout.decode('utf-8', 'replace').split("\0"):
+            if entry:
+                key, _, value = entry.partition("\n")
+                config.setdefault(key, []).append(value)
+        self._config, self._config_stamp = config, stamp
+        return config
+
+    def config_all(self, key):
+        """Return every value of a config key, in the order git reads them."""
+        with self._lock:
+            return list(self._load_config().get(config_key(key), []))
+
+    def config(self, key, default=None):
+        """Return the last value of a config key, like `git config --get`, or default."""
+        values = self.config_all(key)
+        return values[-1] if values else default
+
+    def close(self):
+        """Stop the coprocesses; they are started again if needed."""
+        with self._lock:
+            for process in (self._check, self._batch):
+                if process is not None:
+                    process.close()
+            self._check = self._batch = None
+
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+
+def repository(cwd=None):
+    """Return the shared GitRepository for cwd (default: the current directory)."""
+    cwd = os.path.abspath(cwd or os.getcwd())
+    with _repositories_lock:
+        repo = _repositories.get(cwd)
+        if repo is None:
+            repo = _repositories[cwd] = GitRepository(cwd)
+        return repo
+
+
+def close_all():
+    """Stop every shared repository's coprocesses and forget their answers."""
+    with _repositories_lock:
+        repos = list(_repositories.values())
+        _repositories.clear()
+    for repo in repos:
+        repo.close()
+
+
+atexit.register(close_all)
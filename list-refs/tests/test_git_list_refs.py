@@ -0,0 +1,480 @@
+"""Tests for git-list-refs."""
+
+import io
+import json
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Since the file is named git-list-refs (with hyphens), load it by executing it
+git_list_refs_path = Path(__file__).parent.parent / "git-list-refs"
+git_list_refs = type(sys)('git_list_refs')
+git_list_refs.__file__ = str(git_list_refs_path)
+with open(git_list_refs_path, 'r') as f:
+    exec(f.read(), git_list_refs.__dict__)
+
+
+def git(cwd, *args, input=None):
+    return subprocess.run(["git"] + list(args), cwd=cwd, check=True, input=input,
+                          capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    """A repository with two commits, branches, a remote branch and an annotated tag.
+
+    HEAD (main, origin/main) <- first (feature, v1.0)
+    """
+    path = tmp_path / "repo"
+    path.mkdir()
+    git(path, "init", "-q", "-b", "main")
+    git(path, "config", "user.email", "test@example.com")
+    git(path, "config", "user.name", "Test User")
+    git(path, "commit", "-q", "--allow-empty", "-m", "First")
+    git(path, "branch", "feature")
+    git(path, "tag", "-a", "v1.0", "-m", "Release")
+    git(path, "commit", "-q", "--allow-empty", "-m", "Second")
+    git(path, "update-ref", "refs/remotes/origin/main", "HEAD")
+    monkeypatch.chdir(path)
+    return {"path": path, "head": git(path, "rev-parse", "HEAD"),
+            "first": git(path, "rev-parse", "HEAD~1")}
+
+
+def run_main(*argv, stdin=""):
+    with patch('sys.argv', ['git-list-refs'] + list(argv)), patch('sys.stdin', io.StringIO(stdin)):
+        return git_list_refs.main()
+
+
+class TestBatchLookup:
+    """Test looking up many commits from a single ref scan."""
+
+    def test_ref_map_includes_peeled_tags(self, repo):
+        """Test that annotated tags are found under the commit they point to."""
+        ref_map = git_list_refs.load_ref_map()
+        assert "refs/tags/v1.0" in ref_map[repo["first"]]
+        assert sorted(ref_map[repo["head"]]) == ["refs/heads/main", "refs/remotes/origin/main"]
+
+    def test_get_refs_for_commit_splits_local_and_remote(self, repo):
+        """Test that only branches are reported, split into local and remote."""
+        assert git_list_refs.get_refs_for_commit(repo["head"]) == (["main"], ["origin/main"])
+        assert git_list_refs.get_refs_for_commit(repo["first"]) == (["feature"], [])
+
+    def test_many_commits_use_one_ref_scan(self, repo, capsys):
+        """Test that commits from arguments and stdin are answered from one ref scan."""
+        calls = []
+        real_run = subprocess.run
+        real_popen = subprocess.Popen
+
+        def run(cmd, *args, **kwargs):
+            calls.append(cmd)
+            return real_run(cmd, *args, **kwargs)
+
+        def popen(cmd, *args, **kwargs):
+            # subprocess.run goes through Popen too; only count the coprocesses
+            if kwargs.get('stdin') == subprocess.PIPE:
+                calls.append(cmd)
+            return real_popen(cmd, *args, **kwargs)
+
+        real_list_refs = git_list_refs.list_refs
+        with patch.object(git_list_refs.subprocess, 'run', side_effect=run), \
+                patch.object(git_list_refs.subprocess, 'Popen', side_effect=popen), \
+                patch.object(git_list_refs, 'read_refs_directly', side_effect=git_list_refs.RefFormatError), \
+                patch.object(git_list_refs, 'list_refs', side_effect=real_list_refs) as list_refs:
+            assert run_main("--no-index", "HEAD", "--stdin", stdin=f"{repo['first']}\nmain\n") == 0
+
+        assert list_refs.call_count == 1
+        assert sum("for-each-ref" in cmd for cmd in calls) == 1
+        assert sum("cat-file" in cmd for cmd in calls) == 1
+        out = capsys.readouterr().out
+        assert out.count(f"Refs pointing to {repo['head'][:8]}:") == 2
+        assert f"Refs pointing to {repo['first'][:8]}:" in out
+        assert "feature" in out
+
+    def test_invalid_commit_is_reported(self, repo, capsys):
+        """Test that a bad revision is reported without stopping the others."""
+        assert run_main("no-such-rev", "HEAD") == 1
+        captured = capsys.readouterr()
+        assert "'no-such-rev' is not a commit" in captured.err
+        assert f"Refs pointing to {repo['head'][:8]}:" in captured.out
+
+    def test_defaults_to_head(self, repo, capsys):
+        """Test that HEAD is shown when no commits are given."""
+        assert run_main() == 0
+        assert capsys.readouterr().out.startswith(f"Refs pointing to {repo['head'][:8]}:")
+
+
+class TestRefIndex:
+    """Test the on-disk reverse ref index."""
+
+    def _count_scans(self):
+        calls = []
+        real_load = git_list_refs.load_ref_map
+
+        def load():
+            calls.append(1)
+            return real_load()
+        return calls, patch.object(git_list_refs, 'load_ref_map', side_effect=load)
+
+    def test_index_is_reused_while_refs_are_unchanged(self, repo):
+        """Test that a second lookup answers from the index without scanning refs."""
+        git_dir = git_list_refs.get_git_dir()
+        git_list_refs.RefIndex(git_dir).close()
+
+        calls, patched = self._count_scans()
+        with patched:
+            index = git_list_refs.RefIndex(git_dir)
+            assert git_list_refs.get_refs_for_commit(repo["head"], index) == (["main"], ["origin/main"])
+        assert calls == []
+        assert (Path(git_dir) / "git-list-refs" / "ref-index").exists()
+
+    @pytest.mark.parametrize("change", [
+        ["branch", "newbranch"],
+        ["branch", "-f", "feature", "HEAD"],
+        ["update-ref", "refs/remotes/origin/topic/deep", "HEAD"],
+        ["pack-refs", "--all"],
+    ])
+    def test_index_is_rebuilt_when_refs_change(self, repo, change):
+        """Test that loose ref and packed-refs changes invalidate the index."""
+        git_dir = git_list_refs.get_git_dir()
+        git_list_refs.RefIndex(git_dir).close()
+        git(repo["path"], *change)
+
+        calls, patched = self._count_scans()
+        with patched:
+            index = git_list_refs.RefIndex(git_dir)
+            assert sorted(index.lookup(repo["head"])) == sorted(git_list_refs.load_ref_map()[repo["head"]])
+        assert len(calls) == 2
+
+    def test_lookup_matches_ref_scan(self, repo):
+        """Test that binary search over the index finds every object in a packed repository."""
+        commits = [repo["first"], repo["head"]]
+        for i in range(50):
+            commits.append(git(repo["path"], "commit-tree", "-p", commits[-1], "-m", f"c{i}",
+                               f"{repo['head']}^{{tree}}"))
+        updates = "".join(f"create refs/tags/t{i} {sha}\n" for i, sha in enumerate(commits))
+        subprocess.run(["git", "update-ref", "--stdin"], input=updates, text=True, check=True)
+        git(repo["path"], "pack-refs", "--all")
+
+        ref_map = git_list_refs.load_ref_map()
+        index = git_list_refs.RefIndex(git_list_refs.get_git_dir())
+        for sha in ref_map:
+            assert sorted(index.lookup(sha)) == sorted(ref_map[sha])
+        assert index.lookup("0" * 40) == []
+        assert index.lookup("f" * 40) == []
+
+
+class TestDirectRefReading:
+    """Test reading packed-refs and loose refs without running git."""
+
+    def _add_tags(self, repo):
+        git(repo["path"], "tag", "lightweight", repo["first"])
+        git(repo["path"], "tag", "-a", "annotated", "-m", "Tag", repo["head"])
+        git(repo["path"], "symbolic-ref", "refs/remotes/origin/HEAD", "refs/remotes/origin/main")
+
+    def _direct(self):
+        return git_list_refs.read_refs_directly(git_list_refs.find_git_dirs()[1])
+
+    def test_loose_refs_match_for_each_ref(self, repo):
+        """Test loose branches, tags and symbolic refs against for-each-ref."""
+        self._add_tags(repo)
+        assert self._direct() == git_list_refs.list_refs()
+
+    def test_packed_refs_match_for_each_ref(self, repo):
+        """Test packed refs with peeled lines, overridden by newer loose refs."""
+        self._add_tags(repo)
+        git(repo["path"], "pack-refs", "--all")
+        git(repo["path"], "branch", "-f", "feature", repo["head"])
+        git(repo["path"], "tag", "-a", "late", "-m", "Tag", repo["first"])
+        git(repo["path"], "repack", "-adq")  # the loose tag's object is now packed
+        assert (repo["path"] / ".git" / "refs" / "tags" / "late").exists()
+        assert self._direct() == git_list_refs.list_refs()
+
+    def test_tag_of_tag_peels_the_same_before_and_after_packing(self, repo):
+        """Test that a tag pointing at another tag peels to the commit in every reading path."""
+        git(repo["path"], "tag", "-a", "outer", "-m", "Tag of a tag", "v1.0")
+        outer = git(repo["path"], "rev-parse", "refs/tags/outer")
+        expected = ("refs/tags/outer", outer, repo["first"])
+
+        loose = self._direct()
+        assert expected in loose
+        assert loose == git_list_refs.list_refs()
+        git(repo["path"], "pack-refs", "--all")
+        assert self._direct() == loose
+        assert git_list_refs.list_refs() == loose
+        assert "refs/tags/outer" in git_list_refs.load_ref_map()[repo["first"]]
+
+    def test_worktree_reads_common_refs(self, repo, tmp_path, monkeypatch):
+        """Test that a linked worktree finds the shared refs and its own HEAD."""
+        worktree = tmp_path / "wt"
+        git(repo["path"], "worktree", "add", "-q", str(worktree), repo["first"])
+        monkeypatch.chdir(worktree)
+        git_dir, common_dir = git_list_refs.find_git_dirs()
+        assert common_dir == str(repo["path"] / ".git")
+        assert git_dir != common_dir
+        assert git_list_refs.read_head() == repo["first"]
+        assert self._direct() == git_list_refs.list_refs()
+
+    def test_head_lookup_runs_no_git(self, repo, capsys):
+        """Test that the default HEAD lookup with a fresh index never forks git."""
+        git(repo["path"], "pack-refs", "--all")
+        run_main()
+        capsys.readouterr()
+        with patch.object(git_list_refs.subprocess, 'run', side_effect=AssertionError("ran git")):
+            assert run_main() == 0
+        assert f"Refs pointing to {repo['head'][:8]}:" in capsys.readouterr().out
+
+    @pytest.mark.parametrize("breakage", ["reftable", "old-packed-refs"])
+    def test_falls_back_to_for_each_ref(self, repo, breakage):
+        """Test that unsupported ref storage is read through git instead."""
+        git_dir = repo["path"] / ".git"
+        if breakage == "reftable":
+            (git_dir / "reftable").mkdir()
+        else:
+            git(repo["path"], "pack-refs", "--all")
+            packed = (git_dir / "packed-refs").read_text().split("\n", 1)[1]
+            (git_dir / "packed-refs").write_text(packed)
+
+        with pytest.raises(git_list_refs.RefFormatError):
+            self._direct()
+        real_list_refs = git_list_refs.list_refs
+        with patch.object(git_list_refs, 'list_refs', side_effect=real_list_refs) as list_refs:
+            ref_map = git_list_refs.load_ref_map()
+        assert list_refs.called
+        assert sorted(ref_map[repo["head"]]) == ["refs/heads/main", "refs/remotes/origin/main"]
+
+
+class TestAnnotate:
+    """Test the --annotate filter for git log output."""
+
+    def test_annotates_git_log_output(self, repo):
+        """Test that each hash gets its local and remote refs, colored and split."""
+        log = subprocess.run(["git", "log", "--format=%H %s"], capture_output=True, check=True).stdout
+        out = io.BytesIO()
+        git_list_refs.annotate_stream(git_list_refs.load_ref_map(), io.BytesIO(log), out)
+
+        lines = out.getvalue().decode().splitlines()
+        red, cyan, reset = git_list_refs.RED, git_list_refs.CYAN, git_list_refs.RESET
+        assert lines == [
+            f"{repo['head']} Second ({red}main{reset} | {red}origin/main{reset})",
+            f"{repo['first']} First ({cyan}feature{reset})",
+        ]
+
+    def test_other_lines_pass_through(self, repo):
+        """Test that lines without a known leading hash are left alone, bytes and all."""
+        lines = [b"\n", b"not a hash\n", b"0" * 40 + b" unknown\n", b"caf\xe9 latin-1\n"]
+        assert list(git_list_refs.annotate_lines(lines, git_list_refs.load_ref_map())) == lines
+
+    def test_streams_lazily(self, repo):
+        """Test that output is produced before the input is exhausted."""
+        def endless():
+            while True:
+                yield f"{repo['first']} again\n".encode()
+
+        annotated = git_list_refs.annotate_lines(endless(), git_list_refs.load_ref_map())
+        for _ in range(1000):
+            assert b"feature" in next(annotated)
+
+    def test_main_loads_refs_once(self, repo):
+        """Test that --annotate scans the refs once for the whole stream."""
+        stdin = io.TextIOWrapper(io.BytesIO(f"{repo['head']}\n".encode() * 100))
+        stdout = io.TextIOWrapper(io.BytesIO())
+        real_load = git_list_refs.load_ref_map
+        with patch.object(git_list_refs, 'load_ref_map', side_effect=real_load) as load, \
+                patch('sys.argv', ['git-list-refs', '--annotate', '--no-index']), \
+                patch('sys.stdin', stdin), patch('sys.stdout', stdout):
+            assert git_list_refs.main() == 0
+        assert load.call_count == 1
+        assert stdout.buffer.getvalue().count(b"main") == 200
+
+
+class TestContains:
+    """Test --contains and its commit-graph walk."""
+
+    def _history(self, repo):
+        """Add a side branch merged into main, an octopus merge and an older branch.
+
+        Returns the commits of the linear part of main, oldest first.
+        """
+        path = repo["path"]
+        linear = [repo["first"], repo["head"]]
+        for i in range(20):
+            git(path, "commit", "-q", "--allow-empty", "-m", f"Main {i}")
+            linear.append(git(path, "rev-parse", "HEAD"))
+        git(path, "checkout", "-q", "-b", "side", linear[5])
+        git(path, "commit", "-q", "--allow-empty", "-m", "Side")
+        git(path, "checkout", "-q", "-b", "other", linear[8])
+        git(path, "commit", "-q", "--allow-empty", "-m", "Other")
+        git(path, "checkout", "-q", "main")
+        git(path, "merge", "-q", "--no-edit", "side", "other")
+        git(path, "branch", "old", linear[3])
+        git(path, "update-ref", "refs/remotes/origin/main", linear[12])
+        return linear
+
+    def _check_all(self, walker):
+        ref_map = git_list_refs.load_ref_map()
+        for sha in git(".", "rev-list", "--all").split():
+            expected = sorted(git_list_refs.containing_refs_from_git(sha))
+            assert git_list_refs.get_refs_containing_commit(sha, ref_map, walker) == expected
+
+    def test_walk_matches_git(self, repo):
+        """Test the walk against for-each-ref --contains, with and without a commit-graph."""
+        self._history(repo)
+        git(repo["path"], "commit-graph", "write", "--reachable")
+        git(repo["path"], "commit", "-q", "--allow-empty", "-m", "Not in the graph yet")
+        walker = git_list_refs.CommitWalker(git_list_refs.CommitGraph(".git/objects"))
+        self._check_all(walker)
+        self._check_all(None)
+
+    def test_split_commit_graph_chain(self, repo):
+        """Test reading a commit-graph chain with more than one layer."""
+        linear = self._history(repo)
+        git(repo["path"], "commit-graph", "write", "--reachable", "--split")
+        git(repo["path"], "branch", "later", linear[-1])
+        git(repo["path"], "commit", "-q", "--allow-empty", "-m", "Second layer")
+        git(repo["path"], "commit-graph", "write", "--reachable", "--split=no-merge")
+        graph = git_list_refs.CommitGraph(".git/objects")
+        assert len(graph.layers) == 2
+        self._check_all(git_list_refs.CommitWalker(graph))
+
+    def test_generation_numbers_prune_the_walk(self, repo):
+        """Test that commits older than the target are not read."""
+        linear = self._history(repo)
+        git(repo["path"], "commit-graph", "write", "--reachable")
+        walker = git_list_refs.CommitWalker(git_list_refs.CommitGraph(".git/objects"))
+        visited = []
+        real_info = walker.info
+        with patch.object(walker, 'info', side_effect=lambda sha: visited.append(sha) or real_info(sha)):
+            assert walker.contains(linear[15], [git(".", "rev-parse", "main")]) == {git(".", "rev-parse", "main")}
+        assert not set(visited) & set(linear[:15])
+
+    def test_results_cached_per_ref_state(self, repo, capsys):
+        """Test that repeated queries are answered from the cache until refs change."""
+        linear = self._history(repo)
+        assert run_main("--contains", linear[4]) == 0
+        first = capsys.readouterr().out
+        assert "old" not in first and "side" in first and "origin/main" in first
+
+        with patch.object(git_list_refs, 'get_refs_containing_commit', side_effect=AssertionError):
+            assert run_main("--contains", linear[4]) == 0
+        assert capsys.readouterr().out == first
+
+        git(repo["path"], "branch", "newer", linear[6])
+        assert run_main("--contains", linear[4]) == 0
+        assert "newer" in capsys.readouterr().out
+
+    def test_cache_has_its_own_format_version(self, repo):
+        """Test that only the contains cache's own version invalidates its files."""
+        git_dir = str(repo["path"] / ".git")
+        git_list_refs.ContainsCache(git_dir).add(repo["first"], ["refs/heads/feature"])
+
+        with patch.object(git_list_refs, 'REF_INDEX_VERSION', git_list_refs.REF_INDEX_VERSION + 1):
+            assert git_list_refs.ContainsCache(git_dir).get(repo["first"]) == ["refs/heads/feature"]
+        with patch.object(git_list_refs, 'CONTAINS_CACHE_VERSION', git_list_refs.CONTAINS_CACHE_VERSION + 1):
+            assert git_list_refs.ContainsCache(git_dir).get(repo["first"]) is None
+
+
+class TestJsonOutput:
+    """Test --format=json and --format=ndjson."""
+
+    def test_ndjson_record_per_commit(self, repo, capsys):
+        """Test one JSON object per line, including errors for bad revisions."""
+        assert run_main("--format=ndjson", "HEAD", "HEAD~1", "nope") == 1
+        records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert records[0] == {'rev': 'HEAD', 'commit': repo['head'], 'relation': 'points-at',
+                              'local': ['main'], 'remote': ['origin/main'],
+                              'refs': ['refs/heads/main', 'refs/remotes/origin/main']}
+        assert records[1]['local'] == ['feature'] and 'refs/tags/v1.0' in records[1]['refs']
+        assert records[2] == {'rev': 'nope', 'commit': None, 'error': 'not a commit'}
+
+    def test_json_contains(self, repo, capsys):
+        """Test that --contains results come out as one JSON array without colors."""
+        assert run_main("--format=json", "--contains", repo['first']) == 0
+        out = capsys.readouterr().out
+        assert "\033[" not in out
+        [record] = json.loads(out)
+        assert record['relation'] == 'contains'
+        assert record['local'] == ['feature', 'main'] and record['remote'] == ['origin/main']
+
+
+class TestSharedGitProcesses:
+    """Test the shared cat-file coprocesses in git_batch.py."""
+
+    @pytest.fixture
+    def shared(self, repo):
+        import git_batch
+        git_batch.close_all()
+        yield git_batch
+        git_batch.close_all()
+
+    def test_queries_share_one_coprocess(self, repo, shared):
+        """Test that revision, ref and object queries reuse the same cat-file processes."""
+        started = []
+        real_popen = subprocess.Popen
+
+        def popen(cmd, *args, **kwargs):
+            started.append(cmd)
+            return real_popen(cmd, *args, **kwargs)
+
+        with patch.object(shared.subprocess, 'Popen', side_effect=popen):
+            repository = shared.repository()
+            assert repository.resolve("HEAD") == repo["head"]
+            assert repository.query(["main", "v1.0^{}", "nope"]) == \
+                [(repo["head"], "commit"), (repo["first"], "commit"), None]
+            obj_type, body = repository.read(repo["head"])
+            assert obj_type == "commit" and f"parent {repo['first']}".encode() in body
+        cat_files = [cmd for cmd in started if cmd[:2] == ["git", "cat-file"]]
+        assert cat_files == [["git", "cat-file", "--batch-check"], ["git", "cat-file", "--batch"]]
+        assert repository.prefix == "" and repository.toplevel == str(repo["path"])
+
+    def test_many_large_objects_do_not_block(self, repo, shared):
+        """Test that answers bigger than a pipe buffer are read while the queries are still written."""
+        blob = git(repo["path"], "hash-object", "-w", "--stdin", input="x" * 65536)
+        # Long queries, so that a few hundred of them overflow git's stdin pipe too
+        path = "d" * 200 + "/" + "f" * 200
+        git(repo["path"], "update-index", "--add", "--cacheinfo", f"100644,{blob},{path}")
+        tree = git(repo["path"], "write-tree")
+        cat_file = shared.CatFile(str(repo["path"]))
+        try:
+            answers = list(cat_file.query([f"{tree}:{path}"] * 1000))
+            assert [answer[0] for answer in answers] == [blob] * 1000
+            assert all(len(answer[2]) == 65536 for answer in answers)
+        finally:
+            cat_file.close()
+
+    def test_only_object_name_queries_are_cached(self, repo, shared):
+        """Test that answers naming refs are asked again, since refs move."""
+        repository = shared.repository()
+        assert repository.resolve("feature") == repo["first"]
+        assert repository.resolve(f"{repo['head']}^") == repo["first"]
+        git(repo["path"], "branch", "-f", "feature", "HEAD")
+        assert repository.resolve("feature") == repo["head"]
+        assert ('info', f"{repo['head']}^") in repository.cache
+        assert ('info', "feature") not in repository.cache
+
+    def test_lru_drops_least_recently_used(self, shared):
+        """Test that the cache keeps at most its size, evicting the oldest entry."""
+        cache = shared.LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert "b" not in cache and cache.get("a") == 1 and cache.get("c") == 3
+
+    def test_config_is_reread_after_change(self, repo, shared):
+        """Test that config values come from one listing, refreshed when the file changes."""
+        repository = shared.repository()
+        assert repository.config("user.name") == "Test User"
+        assert repository.config("User.Name") == "Test User"
+        git(repo["path"], "config", "remote.Origin.url", "/somewhere/else")
+        assert repository.config("remote.Origin.url") == "/somewhere/else"
+        assert repository.config("remote.origin.url") is None
+
+    def test_outside_a_repository(self, tmp_path, shared, monkeypatch):
+        """Test that queries outside a repository raise GitError."""
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(tmp_path.parent))
+        with pytest.raises(shared.GitError):
+            shared.repository().resolve("HEAD")
@@ -0,0 +1,208 @@
+"""Benchmark harness for git-rp.
+
+Builds synthetic repositories with the test fixtures, pushes them to local
+bare remotes with git-rp and measures wall time, the number of git commands
+git-rp starts and peak memory. Results can be saved as a baseline and later
+runs compared against it.
+
+Run from the stree directory:
+
+    python -m tests.benchmark                                 # Default scenarios
+    python -m tests.benchmark -s 200,4,2 -s 1000,1,1          # COMMITS,SUBTREES,DEPTH
+    python -m tests.benchmark --save baseline.json            # Record a baseline
+    python -m tests.benchmark --compare baseline.json         # Exit 1 on a regression
+
+Each scenario is measured twice: "push" pushes everything from a fresh
+copy of the repository, "noop" pushes again when nothing has changed.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .test_fixtures import create_synthetic_repo_structure
+
+GIT_RP = Path(__file__).parent.parent / "git-rp"
+
+DEFAULT_SCENARIOS = [(50, 4, 1), (50, 2, 3), (5000, 2, 1), (20000, 4, 2)]
+
+DEFAULT_THRESHOLD = 0.25
+
+# Wall time differences below this are noise, whatever the threshold says
+WALL_NOISE_SECONDS = 0.05
+
+METRICS = ("wall_seconds", "subprocesses", "peak_rss_kib")
+
+
+def scenario_name(commits, subtrees, depth):
+    return f"c{commits}-s{subtrees}-d{depth}"
+
+
+def run_git_rp(cwd, trace, *args):
+    """Run git-rp once, returning (wall seconds, git commands started, peak RSS in KiB).
+
+    The peak is the largest resident set of git-rp or any process it waited
+    for, as reported by wait4().
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, str(GIT_RP), "--profile", str(trace)] + list(args),
+                               cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # Drain stderr before waiting so a chatty push can't block on a full pipe
+    stderr = process.stderr.read()
+    process.stderr.close()
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"git-rp failed in {cwd}:\n{stderr.decode(errors='replace')}")
+
+    with open(trace) as f:
+        events = json.load(f)['traceEvents']
+    subprocesses = sum(1 for event in events if event['cat'] != 'phase')
+    return wall, subprocesses, usage.ru_maxrss
+
+
+def measure(results, wall, subprocesses, peak_rss_kib):
+    """Fold one run into results, keeping the fastest time and the highest peak."""
+    if not results:
+        results.update(wall_seconds=wall, subprocesses=subprocesses, peak_rss_kib=peak_rss_kib)
+        return
+    results['wall_seconds'] = min(results['wall_seconds'], wall)
+    results['subprocesses'] = max(results['subprocesses'], subprocesses)
+    results['peak_rss_kib'] = max(results['peak_rss_kib'], peak_rss_kib)
+
+
+def run_scenario(commits, subtrees, depth, repeat=3):
+    """Build one synthetic repository and measure pushing it repeat times."""
+    results = {'push': {}, 'noop': {}}
+    with tempfile.TemporaryDirectory(prefix="git-rp-bench-") as tmpdir:
+        root = Path(tmpdir)
+        # Remote URLs are absolute, so each run restores the repos to the same place
+        work = root / "work"
+        repos = create_synthetic_repo_structure(work, commits, subtrees, depth)
+        template = root / "template"
+        shutil.copytree(work, template, symlinks=True)
+        main_path = repos['main'].path
+
+        for _ in range(repeat):
+            shutil.rmtree(work)
+            shutil.copytree(template, work, symlinks=True)
+            measure(results['push'], *run_git_rp(main_path, root / "trace.json"))
+            measure(results['noop'], *run_git_rp(main_path, root / "trace.json"))
+    for result in results.values():
+        result['wall_seconds'] = round(result['wall_seconds'], 4)
+    return results
+
+
+def run_benchmarks(scenarios, repeat=3, output=print):
+    """Run every scenario, returning {name: scenario record}."""
+    benchmarks = {}
+    for commits, subtrees, depth in scenarios:
+        name = scenario_name(commits, subtrees, depth)
+        output(f"Running {name} ({commits} commits, {subtrees} subtrees, depth {depth})...")
+        benchmarks[name] = {'commits': commits, 'subtrees': subtrees, 'depth': depth,
+                            'results': run_scenario(commits, subtrees, depth, repeat)}
+    return benchmarks
+
+
+def compare(benchmarks, baseline, threshold):
+    """Compare results with a baseline.
+
+    Returns a list of (scenario, case, metric, baseline value, current value,
+    regressed) tuples for every metric present in both.
+    """
+    rows = []
+    for name, benchmark in benchmarks.items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        for case, results in benchmark['results'].items():
+            for metric in METRICS:
+                old = previous['results'].get(case, {}).get(metric)
+                new = results.get(metric)
+                if old is None or new is None:
+                    continue
+                regressed = new > old * (1 + threshold)
+                if metric == 'wall_seconds' and new - old < WALL_NOISE_SECONDS:
+                    regressed = False
+                rows.append((name, case, metric, old, new, regressed))
+    return rows
+
+
+def print_results(benchmarks, output=print):
+    output(f"\n{'scenario':<16} {'case':<6} {'wall':>9} {'git cmds':>9} {'peak RSS':>11}")
+    for name, benchmark in benchmarks.items():
+        for case, results in benchmark['results'].items():
+            output(f"{name:<16} {case:<6} {results['wall_seconds']:>8.3f}s "
+                   f"{results['subprocesses']:>9} {results['peak_rss_kib']:>7} KiB")
+
+
+def print_comparison(rows, threshold, output=print):
+    output(f"\nCompared with baseline (threshold {threshold:.0%}):")
+    for name, case, metric, old, new, regressed in rows:
+        change = (new - old) / old if old else 0.0
+        flag = "  REGRESSION" if regressed else ""
+        output(f"  {name:<16} {case:<6} {metric:<14} {old:>10} -> {new:<10} ({change:+.1%}){flag}")
+
+
+def parse_scenario(text):
+    try:
+        commits, subtrees, depth = (int(value) for value in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected COMMITS,SUBTREES,DEPTH, got '{text}'")
+    if commits < 1 or subtrees < 0 or depth < 1:
+        raise argparse.ArgumentTypeError(f"need COMMITS >= 1, SUBTREES >= 0 and DEPTH >= 1: '{text}'")
+    return commits, subtrees, depth
+
+
+def parse_command_line(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark git-rp on synthetic repositories")
+    parser.add_argument("-s", "--scenario", action="append", type=parse_scenario,
+                        metavar="COMMITS,SUBTREES,DEPTH",
+                        help="Scenario to run; may be repeated (default: %s)" %
+                             " ".join(",".join(map(str, s)) for s in DEFAULT_SCENARIOS))
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Runs per scenario; the fastest is kept (default: 3)")
+    parser.add_argument("--save", metavar="FILE",
+                        help="Save the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="Compare with a saved baseline and exit 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="Allowed slowdown before a metric counts as a regression, "
+                             f"as a fraction (default: the baseline's, or {DEFAULT_THRESHOLD})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_command_line(argv)
+    benchmarks = run_benchmarks(args.scenario or DEFAULT_SCENARIOS, args.repeat)
+    print_results(benchmarks)
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        threshold = args.threshold if args.threshold is not None else \
+            baseline.get('threshold', DEFAULT_THRESHOLD)
+        rows = compare(benchmarks, baseline, threshold)
+        print_comparison(rows, threshold)
+        if any(row[-1] for row in rows):
+            status = 1
+
+    if args.save:
+        threshold = args.threshold if args.threshold is not None else DEFAULT_THRESHOLD
+        with open(args.save, "w") as f:
+            json.dump({'version': 1, 'threshold': threshold, 'scenarios': benchmarks}, f, indent=2)
+            f.write("\n")
+        print(f"\nSaved baseline to {args.save}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
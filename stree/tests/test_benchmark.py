@@ -0,0 +1,64 @@
+"""Tests for the synthetic repositories and baseline comparison of the benchmark harness."""
+
+import argparse
+
+import pytest
+
+from .benchmark import compare, parse_scenario, run_scenario
+from .test_fixtures import create_synthetic_repo_structure, synthetic_subtree_paths, temp_git_env
+from .test_git_rp import git_rp
+
+
+class TestSyntheticRepo:
+    """Test the generated benchmark repositories."""
+
+    def test_subtree_paths(self):
+        """Test nested chains are listed parents first."""
+        assert synthetic_subtree_paths(2, 2) == ["sub0", "sub0/nested", "sub1", "sub1/nested"]
+        assert synthetic_subtree_paths(0, 3) == []
+
+    def test_hierarchy_is_discovered(self):
+        """Test git-rp finds every generated subtree with its remote."""
+        with temp_git_env() as env:
+            repos = create_synthetic_repo_structure(env["repos_dir"], commits=5, subtrees=2, depth=3)
+            main = repos["main"]
+            assert main.run_git("rev-list", "--count", "HEAD") == "5"
+
+            targets = git_rp.collect_targets(git_rp.discover_subtrees(cwd=main.path), cwd=main.path)
+            paths = [target['subtree']['path'] for target in targets]
+            assert paths == synthetic_subtree_paths(2, 3)
+            assert [target['level'] for target in targets] == [0, 1, 2, 0, 1, 2]
+            for target in targets:
+                assert target['subtree']['url'] == str(repos["bares"][target['subtree']['path']].path)
+
+
+class TestBaseline:
+    """Test measuring and comparing against a baseline."""
+
+    def test_run_scenario(self):
+        """Test a scenario measures a full push and an unchanged push."""
+        results = run_scenario(3, 1, 2, repeat=1)
+        assert set(results) == {"push", "noop"}
+        assert results["push"]["subprocesses"] > results["noop"]["subprocesses"] > 0
+        assert results["push"]["peak_rss_kib"] > 0
+
+    def test_compare_flags_regressions(self):
+        """Test only metrics beyond the threshold (and above timer noise) regress."""
+        baseline = {"scenarios": {"c1-s1-d1": {"results": {"push": {
+            "wall_seconds": 1.0, "subprocesses": 10, "peak_rss_kib": 1000}}}}}
+        current = {"c1-s1-d1": {"results": {"push": {
+            "wall_seconds": 1.5, "subprocesses": 11, "peak_rss_kib": 2000}}},
+            "c2-s1-d1": {"results": {"push": {"wall_seconds": 9.0}}}}
+        rows = compare(current, baseline, 0.25)
+        assert {row[2]: row[-1] for row in rows} == \
+            {"wall_seconds": True, "subprocesses": False, "peak_rss_kib": True}
+
+        baseline["scenarios"]["c1-s1-d1"]["results"]["push"]["wall_seconds"] = 0.01
+        current["c1-s1-d1"]["results"]["push"]["wall_seconds"] = 0.03
+        assert not compare(current, baseline, 0.25)[0][-1]
+
+    def test_parse_scenario(self):
+        """Test scenarios are given as COMMITS,SUBTREES,DEPTH."""
+        assert parse_scenario("100,4,2") == (100, 4, 2)
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_scenario("100,4")
@@ -6,6 +6,7 @@ import tempfile
 import subprocess
 from pathlib import Path
 from contextlib import contextmanager
+from unittest.mock import patch
 
 
 class GitRepo:
@@ -59,6 +60,10 @@ class GitRepo:
         self.run_git("commit", "-m", message)
         return self.run_git("rev-parse", "HEAD")
 
+    def fast_import(self, branch="main"):
+        """Return a FastImport that writes commits straight into branch."""
+        return FastImport(self, branch)
+
     def add_remote(self, name, url):
         """Add a remote to the repository."""
         self.run_git("remote", "add", name, url)
@@ -92,6 +97,74 @@ class GitRepo:
         return any(ref_name in ref for ref in refs)
 
 
+class FastImport:
+    """Stream commits into a repository through a single `git fast-import`.
+
+    Unlike GitRepo.commit, no process is started per commit, so histories
+    of many thousands of commits take seconds. Commits get fixed dates, so
+    the same history always produces the same commit ids. Use as a context
+    manager; on exit the branch is checked out in a non-bare repository.
+    """
+
+    AUTHOR = b"Test User <test@example.com>"
+    EPOCH = 1700000000
+
+    def __init__(self, repo, branch="main"):
+        self.repo = repo
+        self.branch = branch
+        self.count = 0
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            ["git", "fast-import", "--quiet", "--done"],
+            cwd=self.repo.path, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        return self
+
+    def _data(self, content):
+        if isinstance(content, str):
+            content = content.encode()
+        self.process.stdin.write(b"data %d\n%s\n" % (len(content), content))
+
+    def commit(self, files, message="Test commit", deletes=()):
+        """Commit {path: content} changes (and deletions) on top of the previous commit.
+
+        Returns the fast-import mark of the commit, ":<n>".
+        """
+        self.count += 1
+        write = self.process.stdin.write
+        identity = b"%s %d +0000" % (self.AUTHOR, self.EPOCH + self.count)
+        write(b"commit refs/heads/%s\nmark :%d\n" % (self.branch.encode(), self.count))
+        write(b"author %s\ncommitter %s\n" % (identity, identity))
+        self._data(message)
+        if self.count > 1:
+            write(b"from :%d\n" % (self.count - 1))
+        for path in deletes:
+            write(b"D %s\n" % path.encode())
+        for path, content in files.items():
+            write(b"M 100644 inline %s\n" % path.encode())
+            self._data(content)
+        write(b"\n")
+        return f":{self.count}"
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.process.stdin.write(b"done\n")
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = self.process.stderr.read().decode(errors="replace")
+        self.process.stderr.close()
+        if self.process.wait() != 0 and exc_type is None:
+            raise subprocess.CalledProcessError(self.process.returncode, ["git", "fast-import"],
+                                                "", stderr)
+        if exc_type is None and self.count:
+            self.repo.run_git("symbolic-ref", "HEAD", f"refs/heads/{self.branch}")
+            if not self.repo.bare:
+                self.repo.run_git("reset", "--hard", "-q")
+        return False
+
+
 @contextmanager
 def temp_git_env():
     """Create a temporary environment for git tests."""
@@ -114,6 +187,25 @@ def temp_git_env():
             os.chdir(original_dir)
 
 
+@contextmanager
+def record_git_commands(module, command, url=None):
+    """Record the `git <command>` runs the module under test makes through subprocess.run.
+
+    Yields the list the commands are appended to; with url, only commands
+    naming it are recorded. The commands still run.
+    """
+    calls = []
+    real_run = subprocess.run
+
+    def run(cmd, *args, **kwargs):
+        if isinstance(cmd, list) and cmd[:2] == ["git", command] and (url is None or url in cmd):
+            calls.append(cmd)
+        return real_run(cmd, *args, **kwargs)
+
+    with patch.object(module.subprocess, 'run', side_effect=run):
+        yield calls
+
+
 def create_simple_repo_structure(repos_dir):
     """Create a simple repository structure for testing.
 
@@ -145,6 +237,31 @@ def create_simple_repo_structure(repos_dir):
     }
 
 
+def create_configured_subtree_structure(repos_dir):
+    """Create a main repository whose committed .gitsubtrees pushes lib/ to its own bare repository.
+
+    Returns:
+        dict: The main repository, its origin and the subtree's bare repository
+    """
+    main_repo = GitRepo(repos_dir / "main")
+    main_repo.init()
+    main_repo_bare = GitRepo(repos_dir / "main-bare", bare=True)
+    main_repo_bare.init()
+    lib_bare = GitRepo(repos_dir / "lib-bare", bare=True)
+    lib_bare.init()
+    main_repo.add_remote("origin", str(main_repo_bare.path))
+    main_repo.add_file("README.md", "# Main")
+    main_repo.add_file("lib/lib.py", "# Lib")
+    main_repo.add_file(".gitsubtrees", f'[subtree "lib"]\n    url = {lib_bare.path}\n    branch = main\n')
+    main_repo.commit("Initial")
+
+    return {
+        "main": main_repo,
+        "main_bare": main_repo_bare,
+        "lib_bare": lib_bare,
+    }
+
+
 def create_nested_repo_structure(repos_dir):
     """Create a nested repository structure for testing recursive subtrees.
 
@@ -204,6 +321,82 @@ def create_nested_repo_structure(repos_dir):
     }
 
 
+def synthetic_subtree_paths(subtrees, depth):
+    """Return the subtree paths of a synthetic repo, parents before children.
+
+    Each of the top-level subtrees sub0, sub1, ... holds a chain of nested
+    subtrees (sub0/nested, sub0/nested/nested, ...) so that it is depth
+    levels deep.
+    """
+    paths = []
+    for i in range(subtrees):
+        path = f"sub{i}"
+        for _ in range(depth):
+            paths.append(path)
+            path += "/nested"
+    return paths
+
+
+def gitsubtrees_files(paths, bare_path):
+    """Return {directory: .gitsubtrees content} for the given subtree paths.
+
+    bare_path(path) gives the bare remote URL of each subtree; nested entries
+    are written relative to their parent subtree, as git-rp expects.
+    """
+    files = {}
+    for path in paths:
+        parent = path.rsplit("/", 1)[0] if "/" in path else ""
+        name = path[len(parent) + 1:] if parent else path
+        files[parent] = files.get(parent, "") + \
+            f'[subtree "{name}"]\n    url = {bare_path(path)}\n    branch = main\n'
+    return files
+
+
+def create_synthetic_repo_structure(repos_dir, commits=10, subtrees=2, depth=1):
+    """Create a repository with generated history and subtrees for benchmarks.
+
+    The first commit adds every subtree and its committed .gitsubtrees file;
+    the remaining commits each change one file, cycling through the root
+    and the subtree directories. Every subtree gets its own bare remote.
+    The history is written with one `git fast-import`, so large histories
+    are cheap to create.
+
+    Returns:
+        dict: The main repo, its bare remote and a {path: bare repo} dict
+    """
+    paths = synthetic_subtree_paths(subtrees, depth)
+    bares = {}
+    for path in paths:
+        bares[path] = GitRepo(repos_dir / "remotes" / (path.replace("/", "-") + ".git"), bare=True)
+        bares[path].init()
+
+    main_repo = GitRepo(repos_dir / "main-repo")
+    main_repo.init()
+    files = {"README.md": "# Synthetic Repository"}
+    for directory, content in gitsubtrees_files(paths, lambda path: bares[path].path).items():
+        files[f"{directory}/.gitsubtrees" if directory else ".gitsubtrees"] = content
+    for path in paths:
+        files[f"{path}/README.md"] = f"# {path}"
+
+    directories = [""] + paths
+    with main_repo.fast_import() as history:
+        history.commit(files, "Initial commit")
+        for n in range(1, commits):
+            directory = directories[n % len(directories)]
+            path = f"{directory}/file{n % 10}.txt" if directory else f"file{n % 10}.txt"
+            history.commit({path: f"change {n}\n"}, f"Change {n}")
+
+    main_repo_bare = GitRepo(repos_dir / "main-repo-bare", bare=True)
+    main_repo_bare.init()
+    main_repo.add_remote("origin", str(main_repo_bare.path))
+
+    return {
+        "main": main_repo,
+        "main_bare": main_repo_bare,
+        "bares": bares,
+    }
+
+
 def verify_push_occurred(bare_repo, branch="main"):
     """Verify that a push occurred to a bare repository."""
     refs = bare_repo.get_refs()
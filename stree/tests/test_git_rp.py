@@ -1,5 +1,6 @@
 """Comprehensive integration tests for git-rp tool."""
 
+import json
 import os
 import sys
 import subprocess
@@ -14,7 +15,11 @@ from .test_fixtures import (
     temp_git_env,
     create_simple_repo_structure,
     create_nested_repo_structure,
-    verify_push_occurred
+    verify_push_occurred,
+    record_git_commands,
+    create_configured_subtree_structure,
+    create_synthetic_repo_structure,
+    synthetic_subtree_paths,
 )
 from .test_config import ERROR_NOT_GIT_REPO, COMMIT_MESSAGES
 
@@ -27,6 +32,7 @@ sys.path.insert(0, str(git_rp_path.parent))
 
 # Load the module by executing the file
 git_rp = type(sys)('git_rp')
+git_rp.__file__ = str(git_rp_path)
 with open(git_rp_path, 'r') as f:
     exec(f.read(), git_rp.__dict__)
 
@@ -186,9 +192,843 @@ class TestSubtreeOperations:
                 assert git_rp.push_subtree(subtree, "main") is True
 
 
+class TestParallelPush:
+    """Test the -j/--jobs worker pool."""
+
+    def test_parse_jobs_option(self):
+        """Test that -j is parsed as an integer and defaults to serial."""
+        with patch('sys.argv', ['git-rp']):
+            assert git_rp.parse_command_line().jobs == 1
+        with patch('sys.argv', ['git-rp', '-j', '4']):
+            assert git_rp.parse_command_line().jobs == 4
+
+    def test_parallel_push_multiple_subtrees(self, capsys):
+        """Test that all subtrees are pushed and output is grouped per subtree."""
+        with temp_git_env() as env:
+            main = GitRepo(env["repos_dir"] / "main")
+            main.init()
+            main.add_file("README.md", "# Main")
+            main.commit("Initial")
+            main_bare = GitRepo(env["repos_dir"] / "main-bare", bare=True)
+            main_bare.init()
+            main.add_remote("origin", str(main_bare.path))
+
+            bares = []
+            for i in range(1, 4):
+                bare = GitRepo(env["repos_dir"] / f"sub{i}-bare", bare=True)
+                bare.init()
+                main.add_file(f"lib{i}/sub{i}.py", f"# Subtree {i}")
+                bares.append(bare)
+            main.commit("Add subtrees")
+
+            subtrees = [{'path': f"lib{i}", 'url': str(bare.path), 'branch': 'main'}
+                        for i, bare in enumerate(bares, 1)]
+
+            os.chdir(main.path)
+            assert git_rp.push_all_parallel(subtrees, "main", cwd=str(main.path), jobs=3) is True
+
+            out = capsys.readouterr().out
+            assert verify_push_occurred(main_bare)
+            for i, bare in enumerate(bares, 1):
+                assert verify_push_occurred(bare)
+                assert f"  lib{i}: ok" in out
+
+    def test_parallel_nested_subtree_waits_for_parent(self, capsys):
+        """Test that a nested subtree is pushed only after its parent."""
+        with temp_git_env() as env:
+            main = GitRepo(env["repos_dir"] / "main")
+            main.init()
+            lib_bare = GitRepo(env["repos_dir"] / "lib-bare", bare=True)
+            lib_bare.init()
+            inner_bare = GitRepo(env["repos_dir"] / "inner-bare", bare=True)
+            inner_bare.init()
+            main.add_file("README.md", "# Main")
+            main.add_file("lib/lib.py", "# Lib")
+            main.add_file("lib/inner/inner.py", "# Inner")
+            main.add_file("lib/.gitsubtrees",
+                          f'[subtree "inner"]\n    url = {inner_bare.path}\n    branch = main\n')
+            main.commit("Initial")
+            main_bare = GitRepo(env["repos_dir"] / "main-bare", bare=True)
+            main_bare.init()
+            main.add_remote("origin", str(main_bare.path))
+
+            subtrees = [{'path': 'lib', 'url': str(lib_bare.path), 'branch': 'main'}]
+
+            os.chdir(main.path)
+            assert git_rp.push_all_parallel(subtrees, "main", cwd=str(main.path), jobs=4) is True
+
+            out = capsys.readouterr().out
+            assert verify_push_occurred(lib_bare)
+            assert verify_push_occurred(inner_bare)
+            assert out.index("Pushing subtree 'lib'") < out.index("Pushing nested subtree 'inner'")
+            assert "  lib/inner: ok" in out
+
+    def test_parallel_push_combines_failures(self, capsys):
+        """Test that one failing subtree fails the run without stopping the others."""
+        with temp_git_env() as env:
+            main = GitRepo(env["repos_dir"] / "main")
+            main.init()
+            main.add_file("README.md", "# Main")
+            main.add_file("good/file.py", "# Good")
+            main.add_file("bad/file.py", "# Bad")
+            main.commit("Initial")
+            main_bare = GitRepo(env["repos_dir"] / "main-bare", bare=True)
+            main_bare.init()
+            main.add_remote("origin", str(main_bare.path))
+            good_bare = GitRepo(env["repos_dir"] / "good-bare", bare=True)
+            good_bare.init()
+
+            subtrees = [
+                {'path': 'bad', 'url': '/nonexistent/path/to/repo.git', 'branch': 'main'},
+                {'path': 'good', 'url': str(good_bare.path), 'branch': 'main'},
+            ]
+
+            os.chdir(main.path)
+            assert git_rp.push_all_parallel(subtrees, "main", cwd=str(main.path), jobs=2) is False
+
+            out = capsys.readouterr().out
+            assert verify_push_occurred(good_bare)
+            assert "  bad: FAILED" in out
+            assert "  good: ok" in out
+
+
+class TestBatchedPush:
+    """Test pushing subtrees that share a remote in one git push."""
+
+    def _shared_remote_repo(self, env):
+        main = GitRepo(env["repos_dir"] / "main")
+        main.init()
+        main.add_file("README.md", "# Main")
+        main.add_file("lib1/a.py", "# A")
+        main.add_file("lib2/b.py", "# B")
+        main.commit("Initial")
+        bare = GitRepo(env["repos_dir"] / "shared-bare", bare=True)
+        bare.init()
+        subtrees = [{'path': 'lib1', 'url': str(bare.path), 'branch': 'lib1'},
+                    {'path': 'lib2', 'url': str(bare.path), 'branch': 'lib2'}]
+        return main, bare, subtrees
+
+    def test_group_targets_by_url(self):
+        """Test that targets are grouped by URL, one refspec per branch."""
+        targets = [{'subtree': {'path': p, 'url': u, 'branch': b}, 'parent': None, 'level': 0}
+                   for p, u, b in [('a', 'x', 'main'), ('b', 'y', 'main'),
+                                   ('c', 'x', 'dev'), ('d', 'x', 'main')]]
+        groups = git_rp.group_targets_by_url(targets)
+        assert [(url, [t['subtree']['path'] for t in members]) for url, members in groups] == \
+            [('x', ['a', 'c']), ('y', ['b']), ('x', ['d'])]
+
+    def test_shared_remote_is_pushed_once(self):
+        """Test that subtrees sharing a URL are pushed atomically in a single git push."""
+        with temp_git_env() as env:
+            main, bare, subtrees = self._shared_remote_repo(env)
+            os.chdir(main.path)
+            targets = git_rp.collect_targets(subtrees, cwd=str(main.path))
+            with record_git_commands(git_rp, "push", str(bare.path)) as calls:
+                assert git_rp.push_targets(targets, cwd=str(main.path)) is True
+
+            assert len(calls) == 1
+            assert "--atomic" in calls[0]
+            for branch in ("lib1", "lib2"):
+                assert bare.run_git("rev-parse", "--verify", f"refs/heads/{branch}")
+                assert git_rp.run_command(f"git rev-parse {git_rp.pushed_ref(str(bare.path), branch)}")
+
+    def test_atomic_not_supported_falls_back(self):
+        """Test that a remote without atomic push support still receives every branch."""
+        with temp_git_env() as env:
+            main, bare, subtrees = self._shared_remote_repo(env)
+            bare.run_git("config", "receive.advertiseAtomic", "false")
+            os.chdir(main.path)
+            targets = git_rp.collect_targets(subtrees, cwd=str(main.path))
+            with record_git_commands(git_rp, "push", str(bare.path)) as calls:
+                assert git_rp.push_targets(targets, cwd=str(main.path)) is True
+
+            assert len(calls) == 2
+            assert "--atomic" not in calls[1]
+            for branch in ("lib1", "lib2"):
+                assert bare.run_git("rev-parse", "--verify", f"refs/heads/{branch}")
+
+    def test_parallel_push_batches_shared_remote(self, capsys):
+        """Test that the worker pool also pushes a shared remote in one git push."""
+        with temp_git_env() as env:
+            main, bare, subtrees = self._shared_remote_repo(env)
+            main_bare = GitRepo(env["repos_dir"] / "main-bare", bare=True)
+            main_bare.init()
+            main.add_remote("origin", str(main_bare.path))
+            os.chdir(main.path)
+            with record_git_commands(git_rp, "push", str(bare.path)) as calls:
+                assert git_rp.push_all_parallel(subtrees, "main", cwd=str(main.path), jobs=4) is True
+
+            assert len(calls) == 1
+            out = capsys.readouterr().out
+            assert "  lib1: ok" in out and "  lib2: ok" in out
+
+
+class TestSkipUnchanged:
+    """Test skipping subtrees that are unchanged since the last push."""
+
+    def test_unchanged_subtree_is_skipped(self, capsys):
+        """Test that a second push of the same subtree tree is skipped."""
+        with temp_git_env() as env:
+            repos = create_configured_subtree_structure(env["repos_dir"])
+            main, lib_bare = repos["main"], repos["lib_bare"]
+            os.chdir(main.path)
+
+            with patch('sys.argv', ['git-rp']):
+                assert git_rp.main(sys.argv) == 0
+            first_tip = lib_bare.run_git("rev-parse", "main")
+            capsys.readouterr()
+
+            # Only files outside the subtree change
+            main.add_file("app.py", "# App")
+            main.commit("Change app")
+            with patch('sys.argv', ['git-rp']), \
+                    patch.object(git_rp, 'split_subtree', side_effect=AssertionError("split")):
+                assert git_rp.main(sys.argv) == 0
+            out = capsys.readouterr().out
+            assert "Skipping 1 up-to-date subtree(s):" in out
+            assert "lib: unchanged since last push" in out
+
+            # A change inside the subtree is pushed again
+            main.add_file("lib/more.py", "# More")
+            main.commit("Change lib")
+            with patch('sys.argv', ['git-rp']):
+                assert git_rp.main(sys.argv) == 0
+            assert "Skipping" not in capsys.readouterr().out
+            assert lib_bare.run_git("rev-parse", "main") != first_tip
+
+    def test_no_skip_pushes_everything(self):
+        """Test that --no-skip and --force disable the unchanged check."""
+        with temp_git_env() as env:
+            main = create_configured_subtree_structure(env["repos_dir"])["main"]
+            os.chdir(main.path)
+
+            with patch('sys.argv', ['git-rp']):
+                assert git_rp.main(sys.argv) == 0
+
+            for argv in (['git-rp', '--no-skip'], ['git-rp', '-f']):
+                with patch('sys.argv', argv), \
+                        patch.object(git_rp, 'find_unchanged_subtrees',
+                                     side_effect=AssertionError("checked")):
+                    assert git_rp.main(sys.argv) == 0
+
+    def test_subtree_already_on_remote_is_skipped(self, capsys):
+        """Test that a subtree is skipped when its remote holds its tree, without a record of the push."""
+        with temp_git_env() as env:
+            repos = create_configured_subtree_structure(env["repos_dir"])
+            main, lib_bare = repos["main"], repos["lib_bare"]
+            os.chdir(main.path)
+
+            with patch('sys.argv', ['git-rp']):
+                assert git_rp.main(sys.argv) == 0
+            tip = lib_bare.run_git("rev-parse", "main")
+            main.run_git("update-ref", "-d", git_rp.pushed_ref(str(lib_bare.path), "main"))
+            main.run_git("update-ref", "-d", git_rp.remote_ref(str(lib_bare.path), "main"))
+            capsys.readouterr()
+
+            with patch('sys.argv', ['git-rp']), \
+                    patch.object(git_rp, 'split_subtree', side_effect=AssertionError("split")):
+                assert git_rp.main(sys.argv) == 0
+            assert f"lib: already on {lib_bare.path} (branch: main, commit {tip[:8]})" in \
+                capsys.readouterr().out
+
+    def test_prefetch_asks_each_url_once(self):
+        """Test one ls-remote per URL for all its branches, and None for an unreachable URL."""
+        with temp_git_env() as env:
+            repos = create_configured_subtree_structure(env["repos_dir"])
+            main, lib_bare = repos["main"], repos["lib_bare"]
+            main.run_git("push", "-q", str(lib_bare.path), "main", "main:dev")
+            tip = main.run_git("rev-parse", "HEAD")
+            missing = str(env["repos_dir"] / "missing")
+            targets = [{'subtree': {'path': p, 'url': u, 'branch': b}, 'parent': None, 'level': 0}
+                       for p, u, b in [('a', str(lib_bare.path), 'main'), ('b', missing, 'main'),
+                                       ('c', str(lib_bare.path), 'dev'), ('d', str(lib_bare.path), 'new')]]
+            with record_git_commands(git_rp, "ls-remote") as calls:
+                tips = git_rp.prefetch_remote_tips(targets, cwd=main.path)
+
+            assert tips == {str(lib_bare.path): {'main': tip, 'dev': tip}, missing: None}
+            assert len(calls) == 2
+            assert not git_rp.check_remotes(targets, tips)
+
+    def test_non_fast_forward_rejected_without_push(self, capsys):
+        """Test that an update that would not fast-forward fails without git push unless forced."""
+        with temp_git_env() as env:
+            repos = create_configured_subtree_structure(env["repos_dir"])
+            main, lib_bare = repos["main"], repos["lib_bare"]
+            os.chdir(main.path)
+            with patch('sys.argv', ['git-rp']):
+                assert git_rp.main(sys.argv) == 0
+
+            # The remote branch is replaced by an unrelated history
+            other = GitRepo(env["repos_dir"] / "other")
+            other.init()
+            other.add_file("other.txt", "Other")
+            other.commit("Unrelated")
+            other.run_git("push", "-q", "-f", str(lib_bare.path), "HEAD:main")
+            main.add_file("lib/lib.py", "# Lib 2")
+            main.commit("Update lib")
+            capsys.readouterr()
+
+            with patch('sys.argv', ['git-rp', '--format=json']), \
+                    record_git_commands(git_rp, "push", str(lib_bare.path)) as pushes:
+                assert git_rp.main(sys.argv) == 1
+            lib = {r['path']: r for r in json.loads(capsys.readouterr().out)}['lib']
+            assert pushes == []
+            assert lib['update'] == 'forced'
+            assert lib['reason'] == "[rejected] (non-fast-forward; use -f to force)"
+
+            with patch('sys.argv', ['git-rp', '-f', '--format=json']):
+                assert git_rp.main(sys.argv) == 0
+            lib = {r['path']: r for r in json.loads(capsys.readouterr().out)}['lib']
+            assert lib['update'] == 'forced' and lib['result'] == 'ok'
+            assert lib_bare.run_git("rev-parse", "main") == lib['split_commit']
+
+    def test_find_unchanged_subtrees_without_history(self):
+        """Test that a subtree never pushed by git-rp is not skipped."""
+        with temp_git_env() as env:
+            repos = create_configured_subtree_structure(env["repos_dir"])
+            main, lib_bare = repos["main"], repos["lib_bare"]
+            os.chdir(main.path)
+
+            subtrees = [{'path': 'lib', 'url': str(lib_bare.path), 'branch': 'main'}]
+            assert git_rp.find_unchanged_subtrees(subtrees) == {}
+
+
+class TestResume:
+    """Test resuming a failed run from the push journal."""
+
+    def _setup(self, env):
+        main = GitRepo(env["repos_dir"] / "main")
+        main.init()
+        main_bare = GitRepo(env["repos_dir"] / "main-bare", bare=True)
+        main_bare.init()
+        lib1_bare = GitRepo(env["repos_dir"] / "lib1-bare", bare=True)
+        lib1_bare.init()
+        # lib2's remote rejects every push until its hook is removed
+        lib2_bare = GitRepo(env["repos_dir"] / "lib2-bare", bare=True)
+        lib2_bare.init()
+        hook = lib2_bare.path / "hooks" / "pre-receive"
+        hook.write_text("#!/bin/sh\nexit 1\n")
+        hook.chmod(0o755)
+        main.add_remote("origin", str(main_bare.path))
+        main.add_file("lib1/a.py", "# A")
+        main.add_file("lib2/b.py", "# B")
+        main.add_file(".gitsubtrees", f'[subtree "lib1"]\n    url = {lib1_bare.path}\n'
+                                      f'[subtree "lib2"]\n    url = {lib2_bare.path}\n')
+        main.commit("Initial")
+        return main, lib2_bare
+
+    def _run(self, *argv):
+        with patch('sys.argv', ['git-rp', '--no-skip'] + list(argv)), \
+                record_git_commands(git_rp, "push") as pushes:
+            status = git_rp.main(sys.argv)
+        return status, pushes
+
+    @pytest.mark.parametrize("jobs", ["1", "2"])
+    def test_resume_skips_completed_pushes(self, capsys, jobs):
+        """Test --resume only retries what failed, then forgets the journal."""
+        with temp_git_env() as env:
+            main, lib2_bare = self._setup(env)
+            os.chdir(main.path)
+            journal = main.path / ".git" / "git-rp" / "journal"
+
+            status, _ = self._run('-j', jobs)
+            assert status == 1
+            header, *entries = journal.read_text().splitlines()
+            assert header.startswith("git-rp journal v1 " + main.run_git("rev-parse", "HEAD"))
+            entries.sort()
+            assert len(entries) == 2 and entries[0] == "main"
+            assert entries[1].startswith(f"subtree\tlib1\t{env['repos_dir'] / 'lib1-bare'}\tmain\t")
+
+            (lib2_bare.path / "hooks" / "pre-receive").unlink()
+            capsys.readouterr()
+            status, pushes = self._run('-j', jobs, '--resume')
+            assert status == 0
+            assert [cmd[-2] for cmd in pushes] == [str(lib2_bare.path)]
+            out = capsys.readouterr().out
+            assert "Resuming: main repository done, 1 subtree(s) already pushed" in out
+            assert "already pushed" in out
+            assert not journal.exists()
+            assert lib2_bare.has_ref("refs/heads/main")
+
+    def test_journal_of_another_commit_is_ignored(self, capsys):
+        """Test a new commit starts over instead of resuming."""
+        with temp_git_env() as env:
+            main, lib2_bare = self._setup(env)
+            os.chdir(main.path)
+            assert self._run()[0] == 1
+
+            (lib2_bare.path / "hooks" / "pre-receive").unlink()
+            main.add_file("lib1/a.py", "# A2")
+            main.commit("Change lib1")
+            status, pushes = self._run('--resume')
+            assert status == 0
+            assert len(pushes) == 3
+            assert "Nothing to resume" in capsys.readouterr().out
+
+
+class TestStructuredOutput:
+    """Test --format=json/ndjson records."""
+
+    def test_pushed_bytes(self):
+        """Test reading the pack size from push progress output."""
+        progress = ("Writing objects:  50% (1/2)\rWriting objects: 100% (2/2), 1.50 KiB | 1.50 MiB/s, done.\n"
+                    "Total 2 (delta 0), reused 0 (delta 0), pack-reused 0\n")
+        assert git_rp.pushed_bytes(progress) == 1536
+        assert git_rp.pushed_bytes("Everything up-to-date\n") == 0
+
+    def test_ndjson_records(self, capsys):
+        """Test one record per target with split/push timings, bytes and result."""
+        with temp_git_env() as env:
+            repos = create_configured_subtree_structure(env["repos_dir"])
+            main, lib_bare = repos["main"], repos["lib_bare"]
+            os.chdir(main.path)
+
+            with patch('sys.argv', ['git-rp', '--format=ndjson']):
+                assert git_rp.main(sys.argv) == 0
+            captured = capsys.readouterr()
+            records = [json.loads(line) for line in captured.out.splitlines()]
+            assert "Pushing subtree 'lib'" in captured.err
+
+            assert [(r['type'], r['path'], r['result']) for r in records] == \
+                [('main', None, 'ok'), ('subtree', 'lib', 'ok')]
+            lib = records[1]
+            assert lib['split_commit'] == lib_bare.run_git("rev-parse", "main")
+            assert lib['split_seconds'] >= 0 and lib['push_seconds'] >= 0
+            assert lib['push_bytes'] > 0
+            assert lib['url'] == str(lib_bare.path) and lib['branch'] == 'main'
+
+            with patch('sys.argv', ['git-rp', '--format=ndjson']):
+                assert git_rp.main(sys.argv) == 0
+            records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+            assert records[1]['result'] == 'skipped'
+            assert records[1]['reason'].startswith("unchanged since last push")
+
+    def test_json_parallel_failure(self, capsys):
+        """Test a single JSON document from the parallel scheduler, including failures."""
+        with temp_git_env() as env:
+            repos = create_configured_subtree_structure(env["repos_dir"])
+            main, lib_bare = repos["main"], repos["lib_bare"]
+            main.add_file("bad/file.py", "# Bad")
+            main.add_file(".gitsubtrees", f'[subtree "lib"]\n    url = {lib_bare.path}\n    branch = main\n'
+                                          f'[subtree "bad"]\n    url = {env["repos_dir"] / "missing"}\n')
+            main.commit("Add bad subtree")
+            os.chdir(main.path)
+
+            with patch('sys.argv', ['git-rp', '--format=json', '-j', '3']):
+                assert git_rp.main(sys.argv) == 1
+            records = {r['path']: r for r in json.loads(capsys.readouterr().out)}
+
+            # The unreachable remote fails the run before anything is pushed
+            assert records['bad']['result'] == 'failed'
+            assert records['bad']['reason'] == 'remote unreachable'
+            assert records['bad']['split_commit'] is None
+            assert records['lib']['result'] == 'not attempted'
+            assert None not in records
+
+    def test_remote_tips_fetched_before_push(self, capsys):
+        """Test that a remote tip missing locally is fetched, so the push leaves out what it has."""
+        with temp_git_env() as env:
+            repos = create_configured_subtree_structure(env["repos_dir"])
+            main, lib_bare = repos["main"], repos["lib_bare"]
+            main.add_file("lib/big.txt", os.urandom(128 * 1024).hex())
+            main.commit("Add big file")
+            os.chdir(main.path)
+            with patch('sys.argv', ['git-rp']):
+                assert git_rp.main(sys.argv) == 0
+
+            # Someone else commits to the subtree remote, which is then overwritten
+            other = GitRepo(env["repos_dir"] / "other")
+            other.init()
+            other.run_git("pull", "-q", str(lib_bare.path), "main")
+            other.add_file("notes.txt", "Remote only")
+            other.commit("Remote change")
+            other.run_git("push", "-q", str(lib_bare.path), "HEAD:main")
+            main.add_file("lib/lib.py", "# Lib 2")
+            main.commit("Update lib")
+            capsys.readouterr()
+
+            with patch('sys.argv', ['git-rp', '-f', '--format=json']):
+                assert git_rp.main(sys.argv) == 0
+            lib = {r['path']: r for r in json.loads(capsys.readouterr().out)}['lib']
+
+            url = str(lib_bare.path)
+            assert main.run_git("rev-parse", git_rp.remote_ref(url, "main")) == other.run_git("rev-parse", "HEAD")
+            assert lib['result'] == 'ok'
+            assert 0 < lib['pack_bytes'] < 16 * 1024
+            assert 0 < lib['push_bytes'] < 16 * 1024
+
+    def test_list_remote_tips(self):
+        """Test one ls-remote answering several branches, and an unreachable remote."""
+        with temp_git_env() as env:
+            repos = create_configured_subtree_structure(env["repos_dir"])
+            main, lib_bare = repos["main"], repos["lib_bare"]
+            main.run_git("push", "-q", str(lib_bare.path), "main", "main:dev")
+            tip = main.run_git("rev-parse", "HEAD")
+            assert git_rp.list_remote_tips(str(lib_bare.path), ["main", "dev", "new"], cwd=main.path) == \
+                {'main': tip, 'dev': tip}
+            assert git_rp.list_remote_tips(str(env["repos_dir"] / "missing"), ["main"], cwd=main.path) is None
+
+
+class TestProfile:
+    """Test --profile timing of git commands by phase and subtree."""
+
+    def test_profile_summary_and_trace(self, capsys, tmp_path):
+        """Test the summary lists split and push phases per subtree and the trace is valid."""
+        with temp_git_env() as env:
+            main = create_configured_subtree_structure(env["repos_dir"])["main"]
+            os.chdir(main.path)
+            trace = tmp_path / "trace.json"
+
+            with patch('sys.argv', ['git-rp', '--no-skip', '--profile', str(trace)]):
+                assert git_rp.main(sys.argv) == 0
+            err = capsys.readouterr().err
+            assert "Profile:" in err
+            phases = {tuple(line.split()[:2]) for line in err.splitlines() if line.startswith("  ")}
+            assert ("split", "lib") in phases
+            assert ("push", "lib") in phases
+            assert ("main", "push") in phases
+            assert "git push" in err
+            assert git_rp.Profiler.active is None
+            assert git_rp.subprocess.Popen is subprocess.Popen
+
+            events = json.loads(trace.read_text())['traceEvents']
+            assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in events)
+            commands = [event for event in events if event['cat'] != 'phase']
+            assert any(event['cat'] == 'split' and event['args']['path'] == 'lib' for event in commands)
+            assert any(event['name'] == 'git push' and event['cat'] == 'push' for event in commands)
+
+    def test_phase_is_noop_without_profiler(self):
+        """Test phases cost nothing and record nothing when not profiling."""
+        with git_rp.Profiler.phase("split", "lib"):
+            assert git_rp.Profiler.active is None
+
+
+class TestSplitCache:
+    """Test the persistent split-commit cache."""
+
+    def test_split_is_cached_per_source_commit(self, capsys):
+        """Test that splitting an unchanged HEAD twice reuses the cached split."""
+        with temp_git_env() as env:
+            repos = create_simple_repo_structure(env["repos_dir"])
+            main = repos["main"]
+            main.add_subtree("lib", str(repos["subtree_bare"].path), "main")
+
+            os.chdir(main.path)
+            first = git_rp.split_subtree("lib")
+            expected = main.run_git("subtree", "split", "--prefix=lib")
+            assert first == expected
+            capsys.readouterr()
+
+            assert git_rp.split_subtree("lib") == first
+            assert "Using cached split" in capsys.readouterr().out
+
+            # A new commit is a new cache key
+            (main.path / "lib" / "more.py").write_text("# More")
+            main.commit("Add more")
+            second = git_rp.split_subtree("lib")
+            assert second != first
+            assert "Using cached split" not in capsys.readouterr().out
+
+            cache_dir = main.path / ".git" / "git-rp" / "split-cache"
+            assert len(list(cache_dir.iterdir())) == 1
+
+    def test_stale_cache_entry_is_ignored(self):
+        """Test that a cached split commit missing from the object database is dropped."""
+        with temp_git_env() as env:
+            repos = create_simple_repo_structure(env["repos_dir"])
+            main = repos["main"]
+            main.add_subtree("lib", str(repos["subtree_bare"].path), "main")
+
+            os.chdir(main.path)
+            head = main.run_git("rev-parse", "HEAD")
+            git_dir = git_rp.get_git_dir()
+            cache = git_rp.SplitCache(git_dir, ":lib")
+            cache.update({head: "0" * 40})
+
+            cache = git_rp.SplitCache(git_dir, ":lib")
+            assert cache.get(head, "lib") is None
+            assert git_rp.split_subtree("lib") == main.run_git("subtree", "split", "--prefix=lib")
+
+
+class TestSplitMarkers:
+    """Test split-boundary markers under refs/git-rp/splits/."""
+
+    def test_marker_seeds_next_split(self):
+        """Test a split starts from the last marker, which stays out of branch history."""
+        with temp_git_env() as env:
+            main = TestNativeSplit()._build_history(env)
+            os.chdir(main.path)
+            head = main.run_git("rev-parse", "HEAD")
+            first = git_rp.split_subtree("lib")
+
+            ref = git_rp.split_ref(":lib")
+            assert ref.startswith("refs/git-rp/splits/")
+            assert main.run_git("rev-parse", f"{ref}^1", f"{ref}^2").split() == [head, first]
+            assert main.run_git("branch", "--contains", ref) == ""
+            assert main.run_git("rev-list", "--count", "HEAD") == \
+                main.run_git("rev-list", "--count", f"{ref}^1")
+
+            main.add_file("lib/three.py", "# Three")
+            main.commit("Change lib after split")
+            shutil.rmtree(main.path / ".git" / "git-rp")
+
+            splitter = git_rp.NativeSplitter("lib", marker_key=":lib")
+            assert splitter.split("HEAD") == main.run_git("subtree", "split", "--prefix=lib")
+            assert splitter.marker == (head, first)
+            assert len(splitter.new_entries()) == 1
+
+    def test_marker_used_when_cache_is_stale(self):
+        """Test a stale split cache falls back to the marker, not to a full split."""
+        with temp_git_env() as env:
+            main = TestNativeSplit()._build_history(env)
+            os.chdir(main.path)
+            git_rp.split_subtree("lib")
+            parent = main.run_git("rev-parse", "HEAD")
+
+            main.add_file("lib/three.py", "# Three")
+            main.commit("Change lib after split")
+            git_dir = git_rp.get_git_dir()
+            shutil.rmtree(main.path / ".git" / "git-rp")
+            git_rp.SplitCache(git_dir, ":lib").update({parent: "1" * 40})
+
+            assert git_rp.split_subtree("lib") == main.run_git("subtree", "split", "--prefix=lib")
+            assert git_rp.SplitCache(git_dir, ":lib").entries.keys() == {main.run_git("rev-parse", "HEAD")}
+
+    def test_marker_of_another_prefix_is_ignored(self):
+        """Test markers are only used for the key they were written for."""
+        body = (b"tree t\nparent a\nparent b\nauthor x\ncommitter x\n\n"
+                b"git-rp split marker\n\ngit-rp-split-key: :lib\n")
+        assert git_rp.parse_split_marker(body, ":lib") == ("a", "b")
+        assert git_rp.parse_split_marker(body, ":li") is None
+        assert git_rp.parse_split_marker(body, "sub:lib") is None
+
+
+class TestNativeSplit:
+    """Test that the native split engine matches `git subtree split`."""
+
+    def _build_history(self, env):
+        """Create a repo whose subtree was added, branched, merged and pulled."""
+        repos = create_simple_repo_structure(env["repos_dir"])
+        main = repos["main"]
+        work = repos["subtree_work"]
+        main.add_subtree("lib", str(repos["subtree_bare"].path), "main")
+
+        main.add_file("lib/one.py", "# One")
+        main.commit("Change lib")
+        main.add_file("app.py", "# App")
+        main.commit("Change app only")
+
+        main.create_branch("side")
+        main.add_file("lib/side.py", "# Side")
+        main.commit("Change lib on side")
+        main.run_git("checkout", "main")
+        main.add_file("lib/main.py", "# Main")
+        main.commit("Change lib on main")
+        main.run_git("merge", "--no-edit", "side")
+
+        main.create_branch("app-only")
+        main.add_file("app2.py", "# App 2")
+        main.commit("Change app on branch")
+        main.run_git("checkout", "main")
+        main.add_file("lib/two.py", "# Two")
+        main.commit("Change lib again")
+        main.run_git("merge", "--no-edit", "app-only")
+
+        work.add_file("upstream.py", "# Upstream")
+        work.commit("Upstream change")
+        work.run_git("push", "origin", "main")
+        main.run_git("subtree", "pull", "--prefix=lib", str(repos["subtree_bare"].path), "main",
+                     "-m", "Pull lib")
+        return main
+
+    def test_native_split_matches_git_subtree(self):
+        """Test split hashes on a history with subtree add, merges and pulls."""
+        with temp_git_env() as env:
+            main = self._build_history(env)
+            os.chdir(main.path)
+
+            expected = main.run_git("subtree", "split", "--prefix=lib")
+            assert git_rp.NativeSplitter("lib").split("HEAD") == expected
+            # The rewritten commits were written to the object database
+            assert main.run_git("rev-parse", f"{expected}^{{tree}}") == \
+                main.run_git("rev-parse", "HEAD:lib")
+
+    def test_seeded_split_matches_full_split(self):
+        """Test that a split seeded from a previous run gives the same result."""
+        with temp_git_env() as env:
+            main = self._build_history(env)
+            os.chdir(main.path)
+
+            splitter = git_rp.NativeSplitter("lib")
+            splitter.split("HEAD")
+            known = splitter.new_entries()
+
+            main.add_file("lib/three.py", "# Three")
+            main.commit("Change lib after split")
+            main.run_git("checkout", "-b", "old", "HEAD~4")
+            main.add_file("lib/old.py", "# Old")
+            main.commit("Change lib on an old branch")
+            main.run_git("checkout", "main")
+            main.run_git("merge", "--no-edit", "old")
+
+            seeded = git_rp.NativeSplitter("lib", known=known)
+            assert seeded.split("HEAD") == main.run_git("subtree", "split", "--prefix=lib")
+            assert not seeded.stale
+            assert len(seeded.new_entries()) < len(known)
+
+    def test_stale_seed_falls_back_to_full_split(self):
+        """Test that a seed naming a missing split commit is discarded."""
+        with temp_git_env() as env:
+            main = self._build_history(env)
+            os.chdir(main.path)
+            parent = main.run_git("rev-parse", "HEAD~1")
+
+            main.add_file("lib/three.py", "# Three")
+            main.commit("Change lib after split")
+
+            splitter = git_rp.NativeSplitter("lib", known={parent: "1" * 40})
+            assert splitter.split("HEAD") == main.run_git("subtree", "split", "--prefix=lib")
+            assert splitter.stale
+
+    def test_split_subtree_engines_agree(self):
+        """Test split_subtree with both engines and the shared cache."""
+        with temp_git_env() as env:
+            main = self._build_history(env)
+            os.chdir(main.path)
+
+            via_subtree = git_rp.split_subtree("lib", engine="subtree")
+            shutil.rmtree(main.path / ".git" / "git-rp")
+            main.run_git("update-ref", "-d", git_rp.split_ref(":lib"))
+            assert git_rp.split_subtree("lib", engine="native") == via_subtree
+
+    def test_missing_prefix_fails(self):
+        """Test that splitting a prefix that never existed is an error."""
+        with temp_git_env() as env:
+            repo = GitRepo(env["repos_dir"] / "test")
+            repo.init()
+            repo.add_file("test.txt")
+            repo.commit("Initial")
+            os.chdir(repo.path)
+
+            with pytest.raises(git_rp.SplitError):
+                git_rp.NativeSplitter("nonexistent").split("HEAD")
+
+    @pytest.mark.parametrize("cached", [False, True])
+    def test_removed_prefix_fails_push(self, capsys, cached):
+        """Test that a prefix deleted at the pushed commit fails like git subtree, not with an old split."""
+        with temp_git_env() as env:
+            repos = create_configured_subtree_structure(env["repos_dir"])
+            main, lib_bare = repos["main"], repos["lib_bare"]
+            main.add_file("lib/more.py", "# More")
+            main.commit("Change lib")
+            os.chdir(main.path)
+            if cached:
+                with patch('sys.argv', ['git-rp']):
+                    assert git_rp.main(sys.argv) == 0
+            tip = lib_bare.run_git("rev-parse", "main") if cached else None
+
+            main.run_git("rm", "-rq", "lib")
+            main.commit("Remove lib")
+            with pytest.raises(git_rp.SplitError, match="'lib' does not exist; use 'git subtree add'"):
+                git_rp.NativeSplitter("lib").split("HEAD")
+            with patch('sys.argv', ['git-rp', '--no-skip']):
+                assert git_rp.main(sys.argv) == 1
+            assert "'lib' does not exist; use 'git subtree add'" in capsys.readouterr().err
+            if cached:
+                assert lib_bare.run_git("rev-parse", "main") == tip
+            else:
+                assert not verify_push_occurred(lib_bare)
+
+    def test_write_objects_from_subdirectory(self):
+        """Test that a pack written from a subdirectory lands in the repository's object database."""
+        with temp_git_env() as env:
+            main = self._build_history(env)
+            blobs = [('blob', f"blob {n}\n".encode()) for n in range(git_rp.UNPACK_LIMIT)]
+            git_rp.write_objects(blobs, cwd=str(main.path / "lib"))
+
+            assert not (main.path / "lib" / ".git").exists()
+            for _, body in blobs[:1] + blobs[-1:]:
+                sha = subprocess.run(["git", "hash-object", "--stdin"], input=body, cwd=main.path,
+                                     capture_output=True, check=True).stdout.decode().strip()
+                main.run_git("cat-file", "-e", sha)
+
+
 class TestNestedSubtrees:
     """Test recursive nested subtree operations."""
 
+    def _three_level_repo(self, env):
+        """Create a repo with lib -> inner -> deep committed .gitsubtrees files."""
+        main = GitRepo(env["repos_dir"] / "main")
+        main.init()
+        bares = {}
+        for name in ("lib", "inner", "deep"):
+            bares[name] = GitRepo(env["repos_dir"] / f"{name}-bare", bare=True)
+            bares[name].init()
+        main.add_file("README.md", "# Main")
+        main.add_file(".gitsubtrees", f'[subtree "lib"]\n    url = {bares["lib"].path}\n')
+        main.add_file("lib/lib.py", "# Lib")
+        main.add_file("lib/.gitsubtrees",
+                      f'[subtree "inner"]\n    url = {bares["inner"].path}\n    branch = dev\n')
+        main.add_file("lib/inner/inner.py", "# Inner")
+        main.add_file("lib/inner/.gitsubtrees", f'[subtree "deep"]\n    url = {bares["deep"].path}\n')
+        main.add_file("lib/inner/deep/deep.py", "# Deep")
+        main.commit("Initial")
+        main_bare = GitRepo(env["repos_dir"] / "main-bare", bare=True)
+        main_bare.init()
+        main.add_remote("origin", str(main_bare.path))
+        return main, bares
+
+    def test_discover_subtrees_builds_hierarchy(self):
+        """Test single-pass discovery of nested subtrees from committed files."""
+        with temp_git_env() as env:
+            main, bares = self._three_level_repo(env)
+            # Uncommitted edits are not part of what gets pushed
+            main.add_file("lib/inner/.gitsubtrees", "")
+            os.chdir(main.path)
+
+            subtrees = git_rp.discover_subtrees()
+            assert [s['path'] for s in subtrees] == ["lib"]
+            inner = subtrees[0]['children']
+            assert len(inner) == 1
+            assert inner[0]['path'] == "lib/inner"
+            assert inner[0]['relative_path'] == "inner"
+            assert inner[0]['branch'] == "dev"
+            deep = inner[0]['children']
+            assert [(d['path'], d['relative_path']) for d in deep] == [("lib/inner/deep", "deep")]
+            assert deep[0]['children'] == []
+
+    def test_subtree_engine_splits_nested_subtrees(self):
+        """Test that --split-engine=subtree pushes nested subtrees, as the native engine does."""
+        with temp_git_env() as env:
+            main, bares = self._three_level_repo(env)
+            os.chdir(main.path)
+
+            with patch('sys.argv', ['git-rp', '--split-engine=subtree']):
+                assert git_rp.main(sys.argv) == 0
+            tips = {name: bare.run_git("rev-parse", "dev" if name == "inner" else "main")
+                    for name, bare in bares.items()}
+
+            expected = {
+                "lib": git_rp.split_subtree("lib", cwd=str(main.path)),
+                "inner": git_rp.split_subtree("lib/inner", cwd=str(main.path)),
+                "deep": git_rp.split_subtree("lib/inner/deep", cwd=str(main.path)),
+            }
+            assert tips == expected
+
+    def test_push_reuses_discovered_hierarchy(self):
+        """Test that pushing does not re-read .gitsubtrees files per level."""
+        with temp_git_env() as env:
+            main, bares = self._three_level_repo(env)
+            os.chdir(main.path)
+
+            with patch('sys.argv', ['git-rp']), \
+                    patch.object(git_rp, 'get_nested_subtrees', side_effect=AssertionError("re-read")):
+                assert git_rp.main(sys.argv) == 0
+
+            assert verify_push_occurred(bares["lib"])
+            assert verify_push_occurred(bares["inner"], "dev")
+            assert verify_push_occurred(bares["deep"])
+
     def test_get_nested_subtrees(self):
         """Test detection of nested subtrees."""
         with temp_git_env() as env:
@@ -290,6 +1130,167 @@ class TestNestedSubtrees:
             assert result is True
 
 
+    def test_nested_split_uses_parent_split(self):
+        """Test nested subtrees are split from their parent's split, with the same result."""
+        with temp_git_env() as env:
+            main, bares = self._three_level_repo(env)
+            main.add_file("lib/inner/deep/deep.py", "# Deep 2")
+            main.commit("Update deep")
+            main.add_file("README.md", "# Main 2")
+            main.commit("Update main only")
+            os.chdir(main.path)
+
+            sources = []
+            real_split = git_rp.NativeSplitter.split
+
+            def split(self, rev):
+                sources.append((self.dir, rev))
+                return real_split(self, rev)
+
+            with patch('sys.argv', ['git-rp']), patch.object(git_rp.NativeSplitter, 'split', split):
+                assert git_rp.main(sys.argv) == 0
+
+            tips = {name: bare.run_git("rev-parse", "main" if name != "inner" else "dev")
+                    for name, bare in bares.items()}
+            assert sources == [("lib", main.run_git("rev-parse", "HEAD")),
+                               ("inner", tips["lib"]), ("deep", tips["inner"])]
+            assert git_rp.split_subtree("inner", within="lib") == tips["inner"]
+            assert git_rp.split_subtree("deep", within="lib/inner") == tips["deep"]
+
+    def test_removed_nested_prefix_splits_whole_history(self, capsys):
+        """Test that a nested directory missing from some parent commits is split directly."""
+        with temp_git_env() as env:
+            main, bares = self._three_level_repo(env)
+            main.run_git("rm", "-rq", "lib/inner/deep")
+            main.commit("Drop deep")
+            main.add_file("lib/inner/deep/deep.py", "# Deep again")
+            main.commit("Restore deep")
+            os.chdir(main.path)
+
+            with patch('sys.argv', ['git-rp']):
+                assert git_rp.main(sys.argv) == 0
+            assert "splitting it from the whole history" in capsys.readouterr().out
+            assert bares["deep"].run_git("rev-parse", "main") == \
+                git_rp.split_subtree("deep", within="lib/inner")
+
+
+class TestLargeHistory:
+    """Test histories built with a single git fast-import."""
+
+    def test_fast_import_history(self):
+        """Test streamed commits, deletions and reproducible commit ids."""
+        with temp_git_env() as env:
+            ids = []
+            for name in ("one", "two"):
+                repo = GitRepo(env["repos_dir"] / name)
+                repo.init()
+                with repo.fast_import() as history:
+                    history.commit({"a.txt": "a", "lib/b.txt": "b"}, "First")
+                    history.commit({"lib/b.txt": "b2"}, "Second", deletes=["a.txt"])
+                ids.append(repo.run_git("rev-parse", "HEAD"))
+            assert ids[0] == ids[1]
+            assert repo.run_git("log", "--format=%s") == "Second\nFirst"
+            assert not (repo.path / "a.txt").exists()
+            assert (repo.path / "lib" / "b.txt").read_text() == "b2"
+            assert repo.run_git("status", "--porcelain") == ""
+
+    def test_push_large_nested_history(self):
+        """Test every nested subtree of a 3000 commit history gets exactly its own commits."""
+        commits = 3000
+        with temp_git_env() as env:
+            repos = create_synthetic_repo_structure(env["repos_dir"], commits, subtrees=2, depth=2)
+            os.chdir(repos["main"].path)
+            with patch('sys.argv', ['git-rp', '-j', '2']):
+                assert git_rp.main(sys.argv) == 0
+
+            directories = [""] + synthetic_subtree_paths(2, 2)
+            for path, bare in repos["bares"].items():
+                touched = [d for d in directories if d == path or d.startswith(path + "/")]
+                expected = 1 + sum(1 for n in range(1, commits) if directories[n % len(directories)] in touched)
+                assert bare.run_git("rev-list", "--count", "main") == str(expected)
+            assert repos["main_bare"].run_git("rev-list", "--count", "main") == str(commits)
+
+
+class TestRevPush:
+    """Test pushing a commit with --rev, without a checkout."""
+
+    def _bare_mirror(self, env, repos):
+        """Clone the synthetic main repository bare, pushing back to its origin."""
+        mirror = GitRepo(env["repos_dir"] / "mirror.git", bare=True)
+        subprocess.run(["git", "clone", "-q", "--bare", str(repos["main"].path), str(mirror.path)],
+                       check=True)
+        mirror.run_git("remote", "set-url", "origin", str(repos["main_bare"].path))
+        return mirror
+
+    def _assert_pushed(self, repos, source):
+        """Check every remote got the tree its subtree has at source."""
+        for path, bare in repos["bares"].items():
+            assert bare.run_git("rev-parse", "main^{tree}") == source.run_git("rev-parse", f"main:{path}")
+        assert repos["main_bare"].run_git("rev-parse", "main") == source.run_git("rev-parse", "main")
+
+    @pytest.mark.parametrize("jobs", ["1", "4"])
+    def test_push_from_bare_repository(self, jobs):
+        """Test that nested subtrees are split and pushed from a bare mirror."""
+        with temp_git_env() as env:
+            repos = create_synthetic_repo_structure(env["repos_dir"], 30, subtrees=2, depth=2)
+            mirror = self._bare_mirror(env, repos)
+            os.chdir(mirror.path)
+
+            with patch('sys.argv', ['git-rp']):
+                assert git_rp.main(sys.argv) == 1
+            with patch('sys.argv', ['git-rp', '--rev', 'main', '-j', jobs]):
+                assert git_rp.main(sys.argv) == 0
+            self._assert_pushed(repos, mirror)
+            assert mirror.run_git("for-each-ref", "refs/git-rp/splits") != ""
+
+    def test_subtree_directories_need_not_exist(self):
+        """Test a checkout missing the subtree directories, as in a sparse checkout."""
+        with temp_git_env() as env:
+            repos = create_synthetic_repo_structure(env["repos_dir"], 30, subtrees=2, depth=2)
+            main = repos["main"]
+            for path in synthetic_subtree_paths(2, 1):
+                shutil.rmtree(main.path / path)
+            os.chdir(main.path)
+
+            with patch('sys.argv', ['git-rp', '--rev', 'main']):
+                assert git_rp.main(sys.argv) == 0
+            self._assert_pushed(repos, main)
+
+    def test_rev_matches_checkout_split(self):
+        """Test that --rev produces the same split commits as a push from the checkout."""
+        with temp_git_env() as env:
+            repos = create_synthetic_repo_structure(env["repos_dir"], 30, subtrees=1, depth=2)
+            main = repos["main"]
+            os.chdir(main.path)
+            with patch('sys.argv', ['git-rp']):
+                assert git_rp.main(sys.argv) == 0
+            tips = {path: bare.run_git("rev-parse", "main") for path, bare in repos["bares"].items()}
+
+            mirror = self._bare_mirror(env, repos)
+            os.chdir(mirror.path)
+            with patch('sys.argv', ['git-rp', '--rev', 'main', '--no-skip', '-f']):
+                assert git_rp.main(sys.argv) == 0
+            assert {path: bare.run_git("rev-parse", "main") for path, bare in repos["bares"].items()} == tips
+
+    def test_rev_branch_selection(self, capsys):
+        """Test that a revision other than a branch needs -b, and is pushed to that branch."""
+        with temp_git_env() as env:
+            repos = create_synthetic_repo_structure(env["repos_dir"], 5, subtrees=1, depth=1)
+            mirror = self._bare_mirror(env, repos)
+            mirror.run_git("tag", "v1", "main~1")
+            os.chdir(mirror.path)
+
+            with patch('sys.argv', ['git-rp', '--rev', 'v1']):
+                assert git_rp.main(sys.argv) == 1
+            assert "use -b" in capsys.readouterr().err
+            with patch('sys.argv', ['git-rp', '--rev', 'v1', '-b', 'release']):
+                assert git_rp.main(sys.argv) == 0
+            assert repos["main_bare"].run_git("rev-parse", "release") == mirror.run_git("rev-parse", "v1^{commit}")
+            with patch('sys.argv', ['git-rp', '--rev', 'main', '--split-engine=subtree']):
+                assert git_rp.main(sys.argv) == 1
+            assert "needs a working tree" in capsys.readouterr().err
+
+
 class TestErrorHandling:
     """Test error handling scenarios."""
 
@@ -361,8 +1362,9 @@ class TestErrorHandling:
                 'branch': 'main'
             }
 
-            # Should fail gracefully
-            result = git_rp.push_subtree(subtree_config, "main")
+            # Should fail gracefully, before splitting
+            with patch.object(git_rp, 'split_subtree', side_effect=AssertionError("split")):
+                result = git_rp.push_subtree(subtree_config, "main")
             assert result is False
 
 
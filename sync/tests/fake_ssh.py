@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Local stand-in for ssh/sshd used by the git-sync tests.
+
+Runs the remote command on the local machine with `sh -c` and understands
+the connection-sharing options git-sync uses: ControlMaster=yes creates the
+control socket (a plain file here), ControlPath reuses it, and `-O exit`
+removes it. Every invocation is appended to $FAKE_SSH_LOG as
+"<handshake|mux|master|exit> <host> <command>", so tests can count how many
+connections were really opened.
+"""
+
+import os
+import subprocess
+import sys
+
+
+def main(argv):
+    options = {}
+    control_command = None
+    args = argv[1:]
+    while args and args[0].startswith("-"):
+        flag = args.pop(0)
+        if flag == "-o":
+            key, _, value = args.pop(0).partition("=")
+            options[key] = value
+        elif flag == "-O":
+            control_command = args.pop(0)
+        elif flag in ("-S", "-p", "-l", "-i"):
+            value = args.pop(0)
+            if flag == "-S":
+                options["ControlPath"] = value
+    host, command = args[0], " ".join(args[1:])
+    control_path = options.get("ControlPath")
+
+    if control_command == "exit":
+        kind = "exit"
+        if control_path and os.path.exists(control_path):
+            os.remove(control_path)
+    elif options.get("ControlMaster") == "yes":
+        kind = "master"
+        with open(control_path, "w") as f:
+            f.write(host)
+    elif control_path and os.path.exists(control_path):
+        kind = "mux"
+    else:
+        kind = "handshake"
+
+    with open(os.environ["FAKE_SSH_LOG"], "a") as log:
+        log.write(f"{kind} {host} {command}\n")
+    if kind in ("master", "exit"):
+        return 0
+    return subprocess.run(["sh", "-c", command]).returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
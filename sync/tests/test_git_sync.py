@@ -0,0 +1,316 @@
+"""Integration tests for git-sync, using a local stand-in for ssh."""
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Since the file is named git-sync (with hyphen), load it by executing it
+git_sync_path = Path(__file__).parent.parent / "git-sync"
+git_sync = type(sys)('git_sync')
+git_sync.__file__ = str(git_sync_path)
+with open(git_sync_path, 'r') as f:
+    exec(f.read(), git_sync.__dict__)
+
+FAKE_SSH = Path(__file__).parent / "fake_ssh.py"
+
+
+def git(cwd, *args):
+    return subprocess.run(["git"] + list(args), cwd=cwd, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+def make_remote(path):
+    """Create a non-bare repository with branch 'feature' checked out, as on a build host."""
+    path.mkdir()
+    git(path, "init", "-q")
+    git(path, "config", "user.email", "test@example.com")
+    git(path, "config", "user.name", "Test User")
+    git(path, "config", "alias.co", "checkout")
+    git(path, "commit", "-q", "--allow-empty", "-m", "Initial")
+    git(path, "checkout", "-q", "-b", "feature")
+    return path
+
+
+@pytest.fixture
+def sync_env(tmp_path, monkeypatch):
+    """A local clone on branch 'feature' whose remotes are reached through the fake ssh."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "ssh").write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_SSH}" "$@"\n')
+    (bin_dir / "ssh").chmod(0o755)
+    log = tmp_path / "ssh.log"
+    log.touch()
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_SSH_LOG", str(log))
+    monkeypatch.delenv("GIT_SSH_COMMAND", raising=False)
+    monkeypatch.delenv("GIT_SSH", raising=False)
+
+    local = make_remote(tmp_path / "local")
+    git(local, "commit", "-q", "--allow-empty", "-m", "Local work")
+    monkeypatch.chdir(local)
+    return {"tmp": tmp_path, "local": local, "log": log}
+
+
+def log_entries(env):
+    return [line.split(" ", 2) for line in env["log"].read_text().splitlines()]
+
+
+class TestSshMultiplexing:
+    """Test that git-sync shares one SSH connection per host."""
+
+    def test_one_handshake_per_host(self, sync_env):
+        """Test that the co calls, the push and -c all reuse the master connection."""
+        remote = make_remote(sync_env["tmp"] / "remote")
+        git(sync_env["local"], "remote", "add", "build", f"buildhost:{remote}")
+
+        with patch('sys.argv', ['git-sync', 'build', '-c', 'git rev-parse HEAD']):
+            assert git_sync.main(sys.argv) is None
+
+        kinds = [entry[0] for entry in log_entries(sync_env)]
+        assert kinds.count("master") == 1
+        assert "handshake" not in kinds
+        assert kinds.count("mux") == 4  # co, git-receive-pack, co, -c
+        assert kinds[-1] == "exit"
+        assert git(remote, "rev-parse", "feature") == git(sync_env["local"], "rev-parse", "HEAD")
+        assert git(remote, "rev-parse", "--abbrev-ref", "HEAD") == "feature"
+
+    def test_remotes_on_same_host_share_connection(self, sync_env):
+        """Test that two remotes on one host are synced over a single connection."""
+        for name in ("one", "two"):
+            remote = make_remote(sync_env["tmp"] / name)
+            git(sync_env["local"], "remote", "add", name, f"buildhost:{remote}")
+
+        with patch('sys.argv', ['git-sync', 'one', 'two']):
+            git_sync.main(sys.argv)
+
+        kinds = [entry[0] for entry in log_entries(sync_env)]
+        assert kinds.count("master") == 1
+        assert kinds.count("exit") == 1
+        assert "handshake" not in kinds
+
+    def test_connection_closed_on_failure(self, sync_env):
+        """Test that the master connection is torn down when a remote command fails."""
+        remote = make_remote(sync_env["tmp"] / "remote")
+        git(sync_env["local"], "remote", "add", "build", f"buildhost:{remote}")
+
+        with patch('sys.argv', ['git-sync', 'build', '-c', 'exit 3']):
+            with pytest.raises(subprocess.CalledProcessError):
+                git_sync.main(sys.argv)
+
+        assert log_entries(sync_env)[-1][0] == "exit"
+
+    def test_falls_back_without_master(self, sync_env):
+        """Test that commands still run, one connection each, if the master cannot start."""
+        remote = make_remote(sync_env["tmp"] / "remote")
+        git(sync_env["local"], "remote", "add", "build", f"buildhost:{remote}")
+
+        real_run = subprocess.run
+
+        def refuse_master(cmd, *args, **kwargs):
+            if isinstance(cmd, list) and "ControlMaster=yes" in cmd:
+                return subprocess.CompletedProcess(cmd, 255, "", "mux not supported")
+            return real_run(cmd, *args, **kwargs)
+
+        with patch.object(git_sync.subprocess, 'run', side_effect=refuse_master):
+            with patch('sys.argv', ['git-sync', 'build']):
+                git_sync.main(sys.argv)
+
+        kinds = [entry[0] for entry in log_entries(sync_env)]
+        assert kinds == ["handshake"] * 3
+        assert git(remote, "rev-parse", "feature") == git(sync_env["local"], "rev-parse", "HEAD")
+
+    def test_master_does_not_persist_forever(self, sync_env):
+        """Test that the master is started with a finite ControlPersist."""
+        remote = make_remote(sync_env["tmp"] / "remote")
+        git(sync_env["local"], "remote", "add", "build", f"buildhost:{remote}")
+        masters = []
+        real_run = subprocess.run
+
+        def run(cmd, *args, **kwargs):
+            if isinstance(cmd, list) and "ControlMaster=yes" in cmd:
+                masters.append(cmd)
+            return real_run(cmd, *args, **kwargs)
+
+        with patch.object(git_sync.subprocess, 'run', side_effect=run):
+            with patch('sys.argv', ['git-sync', 'build']):
+                git_sync.main(sys.argv)
+
+        assert len(masters) == 1
+        assert f"ControlPersist={git_sync.CONTROL_PERSIST}" in masters[0]
+
+    def test_connection_closed_on_sigterm(self, sync_env):
+        """Test that SIGTERM still stops the master and removes its control socket directory."""
+        remote = make_remote(sync_env["tmp"] / "remote")
+        git(sync_env["local"], "remote", "add", "build", f"buildhost:{remote}")
+        connections = []
+        real_open = git_sync.open_connections
+
+        def open_connections(*args):
+            connections.extend(real_open(*args))
+            return connections
+
+        def terminate(*args):
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        with patch.object(git_sync, 'open_connections', side_effect=open_connections), \
+                patch.object(git_sync, 'sync_remote', side_effect=terminate), \
+                patch('sys.argv', ['git-sync', 'build']):
+            with pytest.raises(SystemExit) as exc_info:
+                git_sync.main(sys.argv)
+
+        assert exc_info.value.code == 128 + signal.SIGTERM
+        assert log_entries(sync_env)[-1][0] == "exit"
+        assert not os.path.exists(os.path.dirname(connections[0].control_path))
+        assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+
+
+class TestParallelSync:
+    """Test the -j/--jobs concurrent mode."""
+
+    def _add_remotes(self, env, names, host="buildhost"):
+        remotes = {}
+        for name in names:
+            remotes[name] = make_remote(env["tmp"] / name)
+            git(env["local"], "remote", "add", name, f"{host}:{remotes[name]}")
+        return remotes
+
+    def test_parse_jobs_and_timeout(self):
+        """Test that -j and --timeout are parsed and default to serial without a limit."""
+        with patch('sys.argv', ['git-sync']):
+            args = git_sync.parse_command_line()
+            assert args.jobs == 1 and args.timeout is None
+        with patch('sys.argv', ['git-sync', '-j', '4', '--timeout', '30', 'a', 'b']):
+            args = git_sync.parse_command_line()
+            assert args.jobs == 4 and args.timeout == 30 and args.remotes == ['a', 'b']
+
+    def test_parallel_sync_prefixes_output(self, sync_env, capsys):
+        """Test that all remotes are synced, with output prefixed by remote name."""
+        remotes = self._add_remotes(sync_env, ["one", "two", "three"])
+
+        real_run_command = git_sync.run_command
+        calls = []
+
+        def counting_run_command(cmd, **kwargs):
+            calls.append(cmd)
+            return real_run_command(cmd, **kwargs)
+
+        with patch.object(git_sync, 'run_command', side_effect=counting_run_command):
+            with patch('sys.argv', ['git-sync', '-j', '0', '-c', 'echo done', 'one', 'two', 'three']):
+                assert git_sync.main(sys.argv) == 0
+
+        out = capsys.readouterr().out
+        head = git(sync_env["local"], "rev-parse", "HEAD")
+        for name, path in remotes.items():
+            assert git(path, "rev-parse", "feature") == head
+            assert f"[{name}] Synchronizing local branch 'feature'" in out
+            assert f"[{name}] done" in out
+            assert f"  {name}: ok" in out
+        # The branch and remote URLs are read locally, without a shell per query
+        assert not any(cmd.startswith(("git rev-parse", "git config")) for cmd in calls)
+
+    def test_parallel_sync_reports_failures(self, sync_env, capsys):
+        """Test that one failing remote does not stop the others and fails the run."""
+        remotes = self._add_remotes(sync_env, ["good", "bad"])
+        (remotes["bad"] / "broken").touch()
+
+        with patch('sys.argv', ['git-sync', '-j', '2', '-c', 'test ! -e broken', 'good', 'bad']):
+            assert git_sync.main(sys.argv) == 1
+
+        out = capsys.readouterr().out
+        assert "  good: ok" in out
+        assert "  bad: FAILED (exit status 1)" in out
+        assert git(remotes["bad"], "rev-parse", "feature") == git(sync_env["local"], "rev-parse", "HEAD")
+
+    def test_per_remote_timeout(self, sync_env, capsys):
+        """Test that a remote exceeding --timeout is reported as timed out."""
+        self._add_remotes(sync_env, ["fast", "slow"])
+
+        command = 'pwd | grep -q slow && sleep 10 || true'
+        with patch('sys.argv', ['git-sync', '-j', '2', '-t', '2', '-c', command, 'fast', 'slow']):
+            assert git_sync.main(sys.argv) == 1
+
+        out = capsys.readouterr().out
+        assert "  fast: ok" in out
+        assert "  slow: timed out" in out
+
+    def test_serial_timeout_is_reported(self, sync_env, capsys):
+        """Test that without -j a timed out remote is reported and the next one still synced."""
+        remotes = self._add_remotes(sync_env, ["slow", "fast"])
+
+        command = 'pwd | grep -q slow && sleep 10 || true'
+        with patch('sys.argv', ['git-sync', '-t', '2', '-c', command, 'slow', 'fast']):
+            assert git_sync.main(sys.argv) == 1
+
+        assert "Error: 'slow' at buildhost:" in capsys.readouterr().err
+        assert git(remotes["fast"], "rev-parse", "feature") == git(sync_env["local"], "rev-parse", "HEAD")
+
+
+class TestRemoteAgent:
+    """Test the --agent single-session mode."""
+
+    @pytest.fixture(autouse=True, params=["dash", "bash"])
+    def remote_shell(self, request, sync_env):
+        """Run the agent script under each shell that /bin/sh commonly is."""
+        shell = shutil.which(request.param)
+        if shell is None:
+            pytest.skip(f"{request.param} is not installed")
+        (sync_env["tmp"] / "bin" / "sh").symlink_to(shell)
+
+    def _setup(self, env, name="build"):
+        remote = make_remote(env["tmp"] / name)
+        git(env["local"], "remote", "add", name, f"buildhost:{remote}")
+        return remote
+
+    def test_agent_uses_one_session(self, sync_env, capsys):
+        """Test that detach, checkout and -c run in one SSH session around the push."""
+        remote = self._setup(sync_env)
+
+        with patch('sys.argv', ['git-sync', '--agent', '-c', 'git rev-parse --abbrev-ref HEAD', 'build']):
+            assert git_sync.main(sys.argv) is None
+
+        commands = [entry[2] for entry in log_entries(sync_env) if entry[0] == "mux"]
+        assert commands[0] == "sh -s"
+        assert len(commands) == 2 and "git-receive-pack" in commands[1]
+        assert git(remote, "rev-parse", "feature") == git(sync_env["local"], "rev-parse", "HEAD")
+        assert capsys.readouterr().out.splitlines()[-1] == "feature"
+
+    def test_agent_aborts_when_push_fails(self, sync_env):
+        """Test that the agent leaves the remote detached and exits if the push is rejected."""
+        remote = self._setup(sync_env)
+        hook = remote / ".git" / "hooks" / "pre-receive"
+        hook.write_text("#!/bin/sh\nexit 1\n")
+        hook.chmod(0o755)
+
+        with patch('sys.argv', ['git-sync', '--agent', '-c', 'touch ran', 'build']):
+            with pytest.raises(subprocess.CalledProcessError):
+                git_sync.main(sys.argv)
+
+        assert git(remote, "rev-parse", "--abbrev-ref", "HEAD") == "HEAD"
+        assert not (remote / "ran").exists()
+
+    def test_agent_reports_command_failure(self, sync_env, capsys):
+        """Test that a failing command fails the remote in parallel mode."""
+        self._setup(sync_env, "one")
+        self._setup(sync_env, "two")
+
+        with patch('sys.argv', ['git-sync', '--agent', '-j', '2', '-c', 'echo out; exit 4', 'one', 'two']):
+            assert git_sync.main(sys.argv) == 1
+
+        out = capsys.readouterr().out
+        assert "[one] out" in out and "[two] out" in out
+        assert "  one: FAILED (exit status 4)" in out
+
+    def test_agent_timeout(self, sync_env, capsys):
+        """Test that the agent is killed when the remote exceeds its timeout."""
+        self._setup(sync_env)
+
+        with patch('sys.argv', ['git-sync', '--agent', '-j', '2', '-t', '1', '-c', 'sleep 10', 'build']):
+            assert git_sync.main(sys.argv) == 1
+
+        assert "  build: timed out" in capsys.readouterr().out